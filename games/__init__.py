@@ -0,0 +1,7 @@
+"""Tooling around the video game SQL case study in ``notebook (4).py``.
+
+The notebook explores the ``game_sales`` and ``reviews`` tables of the
+``postgresql:///games`` database to find the best years for video game
+releases. The modules in this package keep that analysis fast as the
+tables grow past the 400 rows the case study ships with.
+"""
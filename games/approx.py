@@ -0,0 +1,416 @@
+"""Opt-in approximate "best years" rankings for very large sales tables.
+
+Over tens of millions of ``game_sales`` rows, an exact ``ROUND(AVG(...), 2)``
+per year is more than exploration needs before choosing a slice to drill
+into. This module answers the year-ranking cells (In[22], In[24], In[28]
+and In[32]) from a sample and reports each value with a confidence
+interval and the number of sampled rows behind it.
+
+There are two sources:
+
+* ``"stratified"`` (the default): ``game_sales_sample`` keeps up to
+  ``per_year`` random rows of every year, so thin years are still fully
+  represented. ``sample_tables`` registers it as a ``derived`` table, and
+  every ranking calls ``refresh_sample`` first, which rebuilds it only
+  when ``game_sales`` or ``per_year`` has changed. A year with at most
+  ``per_year`` rows is then sampled in full, and so exact;
+* ``"tablesample"``: ``game_sales TABLESAMPLE BERNOULLI (percent)``, with
+  no setup. Thin years may be missed entirely; those are computed
+  exactly, using the ``game_sales_year_idx`` index to list every year.
+
+Sampled rows are still joined to the full ``reviews`` table on
+``game_id``. A ``game_id`` with several reviews rows joins each sales row
+several times, as it does in the notebook's queries. ``num_games`` is
+therefore estimated as the share of sampled rows with a review, times
+the average number of join rows per such row. Intervals are normal-approximation intervals (``z``
+standard errors) with a finite population correction, so a fully sampled
+year is exact.
+
+The final answer is exact wherever it matters. A year is recomputed
+exactly from ``game_sales`` when:
+
+* its ``num_games`` interval straddles the HAVING threshold;
+* its sample had no scored (or sold) rows, so it has no value at all; or
+* its score interval overlaps the boundary between the top ``limit`` and
+  the rest (for In[32], which has no LIMIT, overlapping any other year's
+  interval).
+
+This repeats until no inexact year is ambiguous. The top-N membership is
+then as certain as the intervals, i.e. at the ``z`` confidence level.
+"""
+
+import math
+
+from . import derived, results
+from .best_years import JOINS, _check, _score
+
+SAMPLE_TABLE = "game_sales_sample"
+Z_99 = 2.576
+
+# The notebook's ranking cells as approximate-mode arguments.
+CELLS = {
+    "In[22]": {
+        "metric": "critic",
+        "nulls": "ignore",
+        "join": "left",
+        "threshold": None,
+    },
+    "In[24]": {"metric": "critic", "nulls": "zero", "join": "inner", "threshold": 4},
+    "In[28]": {"metric": "user", "nulls": "ignore", "join": "inner", "threshold": 4},
+}
+
+
+def sample_tables(per_year=2000, tables=None):
+    """Register the stratified ``game_sales_sample`` on ``tables`` (a new registry by default)."""
+    if tables is None:
+        tables = derived.DerivedTables()
+    tables.register(
+        SAMPLE_TABLE,
+        """
+SELECT s.*,
+       LEAST(s.year_rows, {0}) AS year_sampled
+FROM (
+    SELECT g.*,
+           ROW_NUMBER() OVER (PARTITION BY g.year ORDER BY random()) AS pick,
+           COUNT(*) OVER (PARTITION BY g.year) AS year_rows
+    FROM game_sales AS g
+) AS s
+WHERE s.pick <= {0}""".format(int(per_year)),
+        ["game_sales"],
+    )
+    return tables
+
+
+def refresh_sample(conn, per_year=2000):
+    """Rebuild ``game_sales_sample`` if ``game_sales`` or ``per_year`` changed."""
+    return sample_tables(per_year).refresh(conn)
+
+
+# Every game_sales year, NULL included. Walks game_sales_year_idx one year
+# at a time instead of scanning the table.
+_YEARS_SQL = """
+WITH RECURSIVE years AS (
+    (SELECT year FROM game_sales WHERE year IS NOT NULL ORDER BY year LIMIT 1)
+    UNION ALL
+    SELECT (
+        SELECT g.year FROM game_sales AS g
+        WHERE g.year > y.year
+        ORDER BY g.year
+        LIMIT 1
+    )
+    FROM years AS y
+    WHERE y.year IS NOT NULL
+)
+SELECT year FROM years WHERE year IS NOT NULL
+UNION ALL
+SELECT NULL WHERE EXISTS (SELECT 1 FROM game_sales WHERE year IS NULL)"""
+
+
+def _source(source, percent):
+    """``(FROM item, rows sampled per year, weight per sampled row)`` for ``source``."""
+    if source == "stratified":
+        return (
+            "{} AS g".format(SAMPLE_TABLE),
+            "MAX(g.year_sampled)",
+            "MAX(g.year_rows)::float8 / MAX(g.year_sampled)",
+        )
+    if source == "tablesample":
+        if not 0 < percent <= 100:
+            raise ValueError("percent must be in (0, 100], not {!r}".format(percent))
+        return (
+            "game_sales AS g TABLESAMPLE BERNOULLI ({})".format(float(percent)),
+            "COUNT(*)",
+            "{}::float8".format(100.0 / percent),
+        )
+    if source == "exact":
+        return "game_sales AS g", "COUNT(*)", "1.0::float8"
+    raise ValueError(
+        "source must be stratified or tablesample, not {!r}".format(source)
+    )
+
+
+def stats_sql(source, metric="critic", nulls="ignore", join="inner", percent=1.0):
+    """Per-year sample statistics for a ``%(years)s`` array (NULL for all years).
+
+    ``%(null_year)s`` also selects the NULL year when ``%(years)s`` is given.
+
+    Always LEFT JOINs so every sampled sales row is counted. The inner-join
+    aggregates filter on a matching review instead.
+    """
+    _check("join", join, JOINS)
+    from_item, sampled, weight = _source(source, percent)
+    score = _score(metric, nulls)
+    matched = "" if join == "left" else " FILTER (WHERE r.game_id IS NOT NULL)"
+    sold = "CASE WHEN r.game_id IS NOT NULL THEN COALESCE(g.games_sold, 0) ELSE 0 END"
+    return (
+        "SELECT g.year,\n"
+        "       {sampled} AS sampled,\n"
+        "       {weight} AS weight,\n"
+        "       COUNT(*) AS join_rows,\n"
+        "       COUNT(r.game_id) AS joined,\n"
+        "       COUNT(DISTINCT g.ctid) FILTER (WHERE r.game_id IS NOT NULL) AS matched,\n"
+        "       COUNT({score}){matched} AS n,\n"
+        "       (AVG({score}){matched})::float8 AS mean,\n"
+        "       (STDDEV_SAMP({score}){matched})::float8 AS sd,\n"
+        "       ROUND(AVG({score}){matched}, 2) AS rounded,\n"
+        "       AVG({sold})::float8 AS sold_mean,\n"
+        "       STDDEV_SAMP({sold})::float8 AS sold_sd,\n"
+        "       SUM(g.games_sold) FILTER (WHERE r.game_id IS NOT NULL) AS sold_sum\n"
+        "FROM {from_item}\n"
+        "LEFT JOIN reviews AS r\n"
+        "ON g.game_id = r.game_id\n"
+        "WHERE %(years)s::int[] IS NULL OR g.year = ANY(%(years)s::int[])\n"
+        "   OR (%(null_year)s AND g.year IS NULL)\n"
+        "GROUP BY g.year".format(
+            sampled=sampled,
+            weight=weight,
+            score=score,
+            matched=matched,
+            sold=sold,
+            from_item=from_item,
+        )
+    )
+
+
+def _fetch_stats(conn, sql, years):
+    params = {"years": None, "null_year": False}
+    if years is not None:
+        params["years"] = [year for year in years if year is not None]
+        params["null_year"] = None in years
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        keys = [column.name for column in cur.description]
+        rows = [dict(zip(keys, row)) for row in cur.fetchall()]
+    conn.rollback()
+    return rows
+
+
+def _all_years(conn):
+    with conn.cursor() as cur:
+        cur.execute(_YEARS_SQL)
+        years = {row[0] for row in cur.fetchall()}
+    conn.rollback()
+    return years
+
+
+class Estimate:
+    """One year's estimated value and ``num_games``, each with an interval."""
+
+    def __init__(self, year, value, half_width, count, count_half_width, n, exact):
+        self.year = year
+        self.value = value
+        self.low = None if value is None else value - half_width
+        self.high = None if value is None else value + half_width
+        self.count = count
+        self.count_low = count - count_half_width
+        self.count_high = count + count_half_width
+        self.n = n
+        self.exact = exact
+
+    def sort_key(self):
+        # ORDER BY ... DESC puts NULLs first in Postgres.
+        return math.inf if self.value is None else self.value
+
+
+def _estimate(row, z, kind):
+    weight = row["weight"]
+    sampled = row["sampled"]
+    fpc = max(0.0, 1.0 - 1.0 / weight)
+    exact = fpc == 0.0
+    population = sampled * weight
+
+    # Share of sampled sales rows with a review, and join rows per such row.
+    p = row["matched"] / sampled if sampled else 0.0
+    per_match = row["joined"] / row["matched"] if row["matched"] else 1.0
+    count = population * p * per_match
+    count_half = (
+        z * population * per_match * math.sqrt(p * (1 - p) / sampled * fpc)
+        if sampled
+        else 0.0
+    )
+
+    if kind == "sales":
+        n = sampled
+        join_rows = row["join_rows"]
+        if row["sold_sum"] is None:
+            value, half = None, 0.0
+        elif exact:
+            value, half = float(row["sold_sum"]), 0.0
+        else:
+            value = weight * join_rows * row["sold_mean"]
+            sd = row["sold_sd"] if row["sold_sd"] is not None else math.inf
+            half = z * weight * math.sqrt(join_rows) * sd * math.sqrt(fpc)
+    else:
+        n = row["n"]
+        if row["mean"] is None:
+            value, half = None, 0.0
+        elif exact:
+            value, half = float(row["rounded"]), 0.0
+        else:
+            value = row["mean"]
+            sd = row["sd"] if row["sd"] is not None else math.inf
+            half = z * sd / math.sqrt(n) * math.sqrt(fpc)
+    return Estimate(row["year"], value, half, count, count_half, n, exact)
+
+
+def _ambiguous(estimates, threshold, limit):
+    """Years whose interval leaves their HAVING or top-``limit`` membership open.
+
+    An inexact year without a value is always ambiguous: its sample had no
+    scored rows, but the full year may have some.
+    """
+    ambiguous = set()
+    candidates = []
+    for e in estimates:
+        if e.value is None and not e.exact:
+            ambiguous.add(e.year)
+        if threshold is not None and e.count_low <= threshold < e.count_high:
+            ambiguous.add(e.year)
+        if threshold is None or e.count > threshold:
+            candidates.append(e)
+    candidates.sort(key=Estimate.sort_key, reverse=True)
+    bounded = [e for e in candidates if e.value is not None]
+
+    if limit is None:
+        for i, a in enumerate(bounded):
+            for b in bounded[i + 1 :]:
+                if a.low <= b.high and b.low <= a.high:
+                    ambiguous.update((a.year, b.year))
+        return ambiguous
+
+    top = [e for e in candidates[:limit] if e.value is not None]
+    rest = [e for e in candidates[limit:] if e.value is not None]
+    if top and rest:
+        top_low = min(e.low for e in top)
+        rest_high = max(e.high for e in rest)
+        ambiguous.update(e.year for e in top if e.low <= rest_high)
+        ambiguous.update(e.year for e in rest if e.high >= top_low)
+    return ambiguous
+
+
+def _rank(
+    conn, kind, source, percent, per_year, z, threshold, limit, years=None, **shape
+):
+    if source == "stratified":
+        refresh_sample(conn, per_year)
+    estimates = {
+        row["year"]: _estimate(row, z, kind)
+        for row in _fetch_stats(
+            conn, stats_sql(source, percent=percent, **shape), years
+        )
+    }
+    exact_sql = stats_sql("exact", **shape)
+    if source == "tablesample":
+        # Years with no sampled rows at all have no estimate to be ambiguous.
+        wanted = _all_years(conn) if years is None else set(years)
+        missing = wanted - set(estimates)
+        if missing:
+            for row in _fetch_stats(conn, exact_sql, missing):
+                estimates[row["year"]] = _estimate(row, z, kind)
+    while True:
+        pending = [
+            year
+            for year in _ambiguous(list(estimates.values()), threshold, limit)
+            if not estimates[year].exact
+        ]
+        if not pending:
+            break
+        # A year deleted since sampling returns no row and drops out.
+        for year in pending:
+            del estimates[year]
+        for row in _fetch_stats(conn, exact_sql, pending):
+            estimates[row["year"]] = _estimate(row, z, kind)
+
+    ranked = [e for e in estimates.values() if threshold is None or e.count > threshold]
+    ranked.sort(key=Estimate.sort_key, reverse=True)
+    return ranked if limit is None else ranked[:limit]
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def best_years(
+    conn,
+    metric="critic",
+    nulls="ignore",
+    join="inner",
+    threshold=4,
+    limit=10,
+    source="stratified",
+    percent=1.0,
+    per_year=2000,
+    z=Z_99,
+):
+    """Approximate top ``limit`` years by average score, exact where the ranking needs it.
+
+    Returns a ``Result`` with ``year``, ``num_games``, ``avg_<metric>_score``,
+    ``ci_low``, ``ci_high``, ``sample_rows`` and ``exact``.
+    """
+    ranked = _rank(
+        conn,
+        "score",
+        source,
+        percent,
+        per_year,
+        z,
+        threshold,
+        limit,
+        metric=metric,
+        nulls=nulls,
+        join=join,
+    )
+    keys = ["year", "num_games", "avg_{}_score".format(metric)]
+    keys += ["ci_low", "ci_high", "sample_rows", "exact"]
+    return results.from_rows(
+        keys,
+        [
+            (
+                e.year,
+                int(round(e.count)),
+                _round(e.value),
+                _round(e.low),
+                _round(e.high),
+                e.n,
+                e.exact,
+            )
+            for e in ranked
+        ],
+    )
+
+
+def best_years_sales(
+    conn,
+    years=(1998, 2002, 2008),
+    source="stratified",
+    percent=1.0,
+    per_year=2000,
+    z=Z_99,
+):
+    """In[32] approximately: total games sold in ``years``, with the order made certain.
+
+    As in In[32], a year with reviewed games but no ``games_sold`` values
+    is kept, with a NULL total, first.
+    """
+    ranked = _rank(conn, "sales", source, percent, per_year, z, None, None, years=years)
+    return results.from_rows(
+        ["year", "total_games_sold", "ci_low", "ci_high", "sample_rows", "exact"],
+        [
+            (e.year, _round(e.value), _round(e.low), _round(e.high), e.n, e.exact)
+            for e in ranked
+            if e.count > 0
+        ],
+    )
+
+
+def rank_cell(conn, cell, **options):
+    """Run notebook cell ``cell`` (In[22], In[24], In[28] or In[32]) in approximate mode."""
+    if cell == "In[32]":
+        return best_years_sales(conn, **options)
+    try:
+        shape = CELLS[cell]
+    except KeyError:
+        raise KeyError(
+            "No approximate mode for notebook cell {!r}".format(cell)
+        ) from None
+    return best_years(conn, **dict(shape, **options))
@@ -0,0 +1,395 @@
+"""Benchmark the case-study queries on synthetic data of growing size.
+
+The notebook only ever sees 400 rows. ``generate`` writes synthetic
+``game_sales`` and ``reviews`` CSVs with the shape of the real data:
+
+* release years centred on the late 2000s, between 1977 and 2020;
+* a weighted platform mix and long-tailed publishers and sales;
+* about 1.3 platforms per title, never the same platform twice, so every
+  row survives ``bulk_load``'s (game, platform) dedupe and the columnar
+  engine reads exactly the rows Postgres holds;
+* critic and user scores near 7-8 out of 10;
+* about 8% of sales rows without any review score, as In[20] finds
+  (31 of 400);
+* a few review titles spelled differently, so the normalized ``game_id``
+  join has work to do.
+
+``run`` loads each scale once and times every notebook query (In[19]
+through In[32]) under each configuration:
+
+* ``postgres:indexed``: the notebook SQL on the ``game_id`` join, with
+  the ``game_keys`` indexes;
+* ``postgres:noindex``: the same SQL with those indexes dropped;
+* ``postgres:summary``: the ``year_summary`` lookups, where a cell has one;
+* ``columnar``: ``columnar.Engine`` over the same data.
+
+Each Postgres scale lives in its own ``bench_<rows>`` schema, so the
+case-study tables are never touched. Every table and index the benchmark
+creates, drops or checks is qualified with that schema, and the
+connection's ``search_path`` holds only that schema. The notebook SQL and
+the ``game_keys``, ``year_summary`` and ``derived`` setup therefore
+resolve to the benchmark's own tables and never fall through to
+``public``. Every (scale, config, cell) record
+holds p50/p90/p99 latency, the rows scanned and the memory used. For
+Postgres these come from ``EXPLAIN (ANALYZE, BUFFERS)``; for the columnar
+engine they are its input row count and the peak traced by
+``tracemalloc``. ``--baseline`` compares the run with an earlier results
+file and exits non-zero on a p50 regression.
+
+Usage::
+
+    python -m games.bench --scales 400 13000 1000000 --output bench.json
+    python -m games.bench --scales 400 13000 --baseline bench.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform as host_platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import psycopg2
+
+from . import bulk_load, columnar, derived, game_keys, notebook, year_summary
+
+SCALES = [400, 13000, 1000000, 10000000]
+CONFIGS = ["postgres:indexed", "postgres:noindex", "postgres:summary", "columnar"]
+
+MISSING_REVIEW_RATE = 0.06  # titles with no reviews row
+UNSCORED_RATE = 0.02  # reviewed titles with neither score
+SCORE_NULL_RATE = 0.05  # each score missing on its own
+VARIANT_SPELLING_RATE = 0.03
+ROWS_PER_TITLE = 1.3
+
+PLATFORMS = {
+    "PS2": 0.13, "X360": 0.11, "PS3": 0.11, "Wii": 0.09, "DS": 0.09,
+    "PS4": 0.08, "PC": 0.08, "XOne": 0.06, "PSP": 0.05, "3DS": 0.05,
+    "GBA": 0.04, "PS": 0.04, "NS": 0.03, "N64": 0.02, "GB": 0.01, "NES": 0.01,
+}  # fmt: skip
+
+_CHUNK = 1000000
+_INDEXES = ["game_sales_year_idx", "game_sales_game_id_idx", "reviews_game_id_idx"]
+
+
+def generate(directory, rows, seed=0):
+    """Write ``game_sales.csv`` and ``reviews.csv`` with ``rows`` sales rows; return their paths."""
+    rng = np.random.default_rng(seed)
+    titles = max(1, int(rows / ROWS_PER_TITLE))
+    years = np.clip(np.rint(rng.normal(2007, 7, titles)), 1977, 2020).astype(int)
+    publishers = np.minimum(rng.zipf(1.6, titles), 500)
+    developers = np.minimum(rng.zipf(1.4, titles), 2000)
+    platform_names = list(PLATFORMS)
+    weights = np.array(list(PLATFORMS.values()))
+    weights /= weights.sum()
+    if rows > titles * len(platform_names):
+        raise ValueError("Too many rows for {} titles".format(titles))
+    # Each title's first platform; its k-th extra row moves k platforms on.
+    first_platform = rng.choice(len(platform_names), titles, p=weights)
+    extra_order = rng.permutation(titles)
+
+    sales_path = os.path.join(directory, "game_sales.csv")
+    with open(sales_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(bulk_load.TABLES["game_sales"]["columns"])
+        # Every title sells once, in order; each later pass over the titles,
+        # in a random order, adds one more platform per title.
+        for start in range(0, rows, _CHUNK):
+            n = min(_CHUNK, rows - start)
+            index = np.arange(start, start + n)
+            rounds = index // titles
+            title = np.where(rounds == 0, index, extra_order[index % titles])
+            platform = (first_platform[title] + rounds) % len(platform_names)
+            sold = np.round(rng.lognormal(-1.0, 1.3, n), 2)
+            writer.writerows(
+                (
+                    "Game {}".format(t),
+                    platform_names[p],
+                    "Publisher {}".format(publishers[t]),
+                    "Developer {}".format(developers[t]),
+                    "{:.2f}".format(s),
+                    years[t],
+                )
+                for t, p, s in zip(title.tolist(), platform.tolist(), sold.tolist())
+            )
+
+    reviews_path = os.path.join(directory, "reviews.csv")
+    with open(reviews_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(bulk_load.TABLES["reviews"]["columns"])
+        for start in range(0, titles, _CHUNK):
+            n = min(_CHUNK, titles - start)
+            title = np.arange(start, start + n)
+            reviewed = rng.random(n) >= MISSING_REVIEW_RATE
+            unscored = rng.random(n) < UNSCORED_RATE
+            critic = np.clip(np.round(rng.normal(7.6, 1.1, n), 1), 1, 10)
+            user = np.clip(np.round(rng.normal(7.8, 1.2, n), 1), 1, 10)
+            critic_null = unscored | (rng.random(n) < SCORE_NULL_RATE)
+            user_null = unscored | (rng.random(n) < SCORE_NULL_RATE)
+            variant = rng.random(n) < VARIANT_SPELLING_RATE
+            writer.writerows(
+                (
+                    ("GAME-{}" if v else "Game {}").format(t),
+                    "" if cn else "{:.1f}".format(c),
+                    "" if un else "{:.1f}".format(u),
+                )
+                for t, r, c, u, cn, un, v in zip(
+                    title.tolist(),
+                    reviewed.tolist(),
+                    critic.tolist(),
+                    user.tolist(),
+                    critic_null.tolist(),
+                    user_null.tolist(),
+                    variant.tolist(),
+                )
+                if r
+            )
+    return sales_path, reviews_path
+
+
+def _percentiles(seconds):
+    ms = np.array(seconds) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def _plan_totals(plan, totals=None):
+    """Sum rows scanned and memory over an ``EXPLAIN (ANALYZE, BUFFERS)`` plan tree."""
+    if totals is None:
+        totals = {"rows_scanned": 0, "work_mem_kb": 0}
+    loops = plan.get("Actual Loops", 1)
+    if "Scan" in plan["Node Type"]:
+        totals["rows_scanned"] += int(
+            (plan.get("Actual Rows", 0) + plan.get("Rows Removed by Filter", 0)) * loops
+        )
+    totals["work_mem_kb"] += plan.get("Peak Memory Usage", 0) + plan.get(
+        "Sort Space Used", 0
+    )
+    for child in plan.get("Plans", []):
+        _plan_totals(child, totals)
+    return totals
+
+
+def _schema(rows):
+    return "bench_{}".format(rows)
+
+
+def prepare_postgres(conn, rows, paths, reload=False):
+    """Load one scale into its own schema and install the keys, summary and derived tables."""
+    schema = _schema(rows)
+    with conn.cursor() as cur:
+        cur.execute("CREATE SCHEMA IF NOT EXISTS {}".format(schema))
+        # No public: a missing bench table must fail, not resolve to the real one.
+        cur.execute("SET search_path TO {}".format(schema))
+        conn.commit()
+        cur.execute("SELECT to_regclass(%s)", ("{}.game_sales".format(schema),))
+        loaded = cur.fetchone()[0] is not None and not reload
+        if loaded:
+            cur.execute("SELECT COUNT(*) FROM {}.game_sales".format(schema))
+            loaded = cur.fetchone()[0] == rows
+        if not loaded:
+            cur.execute(
+                "DROP TABLE IF EXISTS {0}.game_sales, {0}.reviews, {0}.game_titles,"
+                " {0}.year_summary CASCADE;\n"
+                "CREATE TABLE {0}.game_sales (game varchar, platform varchar,"
+                " publisher varchar, developer varchar, games_sold numeric, year int);\n"
+                "CREATE TABLE {0}.reviews (game varchar, critic_score numeric,"
+                " user_score numeric);".format(schema)
+            )
+            conn.commit()
+            game_keys.install(conn)
+            year_summary.install(conn)
+            bulk_load.load(conn, *paths)
+    derived.case_study_tables().refresh(conn)
+
+
+def _set_indexes(conn, schema, present):
+    with conn.cursor() as cur:
+        if present:
+            cur.execute(
+                "CREATE INDEX IF NOT EXISTS game_sales_year_idx"
+                " ON {0}.game_sales (year);".format(schema)
+            )
+            for table in ("game_sales", "reviews"):
+                cur.execute(
+                    "CREATE INDEX IF NOT EXISTS {1}_game_id_idx ON {0}.{1} (game_id);"
+                    "ANALYZE {0}.{1};".format(schema, table)
+                )
+        else:
+            for index in _INDEXES:
+                cur.execute("DROP INDEX IF EXISTS {}.{}".format(schema, index))
+    conn.commit()
+
+
+def _time_postgres(conn, sql, repeat):
+    seconds = []
+    with conn.cursor() as cur:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cur.execute(sql)
+            returned = len(cur.fetchall())
+            seconds.append(time.perf_counter() - start)
+        cur.execute(
+            "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)\n" + sql.strip().rstrip(";")
+        )
+        plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+    conn.rollback()
+    top = plan[0]["Plan"]
+    totals = _plan_totals(top)
+    # The top node's buffer counts already include its children's.
+    totals["shared_blocks"] = top.get("Shared Hit Blocks", 0) + top.get(
+        "Shared Read Blocks", 0
+    )
+    record = _percentiles(seconds)
+    record.update(totals, rows_returned=returned)
+    return record
+
+
+def _time_columnar(tables, cell, repeat):
+    seconds, peak = [], 0
+    for _ in range(repeat):
+        engine = columnar.Engine(tables)  # no join cached from an earlier run
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = engine.run(cell)
+        seconds.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    record = _percentiles(seconds)
+    scanned = len(tables) + (0 if cell == "In[19]" else len(tables.critic_score.data))
+    record.update(
+        rows_scanned=scanned, work_mem_kb=peak / 1024.0, rows_returned=len(result)
+    )
+    return record
+
+
+def notebook_queries(path=notebook.NOTEBOOK):
+    """``{label: sql}`` for every ``%%sql`` cell, without the connection line."""
+    return {
+        cell.label: notebook.split_connection(cell.body)[1]
+        for cell in notebook.read_cells(path)
+        if cell.magic == "sql"
+    }
+
+
+def run(dsn, scales=SCALES, configs=CONFIGS, repeat=5, data_dir=None, reload=False):
+    """Benchmark every cell at every scale under every config; return the records."""
+    queries = notebook_queries()
+    data_dir = data_dir or tempfile.mkdtemp(prefix="games-bench-")
+    records = []
+    conn = (
+        psycopg2.connect(dsn)
+        if any(c.startswith("postgres") for c in configs)
+        else None
+    )
+    try:
+        for rows in scales:
+            directory = os.path.join(data_dir, str(rows))
+            os.makedirs(directory, exist_ok=True)
+            paths = (
+                os.path.join(directory, "game_sales.csv"),
+                os.path.join(directory, "reviews.csv"),
+            )
+            if reload or not all(os.path.exists(p) for p in paths):
+                paths = generate(directory, rows)
+            if conn is not None:
+                prepare_postgres(conn, rows, paths, reload)
+            tables = columnar.Tables.from_csv(*paths) if "columnar" in configs else None
+
+            for config in configs:
+                if config in ("postgres:indexed", "postgres:noindex"):
+                    _set_indexes(conn, _schema(rows), config == "postgres:indexed")
+                for cell, sql in queries.items():
+                    if config == "columnar":
+                        record = _time_columnar(tables, cell, repeat)
+                    elif config == "postgres:summary":
+                        if cell not in year_summary.QUERIES:
+                            continue
+                        record = _time_postgres(
+                            conn, year_summary.QUERIES[cell], repeat
+                        )
+                    else:
+                        record = _time_postgres(conn, sql, repeat)
+                    record.update(scale=rows, config=config, cell=cell, repeat=repeat)
+                    records.append(record)
+                    print(
+                        "{:>9} {:<18} {:<7} p50 {:>10.3f} ms  p99 {:>10.3f} ms".format(
+                            rows, config, cell, record["p50_ms"], record["p99_ms"]
+                        ),
+                        file=sys.stderr,
+                    )
+            if conn is not None:
+                _set_indexes(conn, _schema(rows), True)
+    finally:
+        if conn is not None:
+            conn.close()
+    return records
+
+
+def compare(records, baseline, tolerance=1.25):
+    """Return the records whose p50 is more than ``tolerance`` times the baseline's."""
+    previous = {(r["scale"], r["config"], r["cell"]): r for r in baseline}
+    regressions = []
+    for record in records:
+        before = previous.get((record["scale"], record["config"], record["cell"]))
+        if before and record["p50_ms"] > before["p50_ms"] * tolerance:
+            regressions.append((record, before))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dsn", default="postgresql:///games")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES)
+    parser.add_argument("--configs", nargs="+", default=CONFIGS, choices=CONFIGS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--data-dir", help="keep generated CSVs here between runs")
+    parser.add_argument(
+        "--reload", action="store_true", help="regenerate and reload data"
+    )
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    records = run(
+        args.dsn, args.scales, args.configs, args.repeat, args.data_dir, args.reload
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "host": host_platform.node(),
+                "python": host_platform.python_version(),
+                "records": records,
+            },
+            f,
+            indent=2,
+        )
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["records"]
+        regressions = compare(records, baseline, args.tolerance)
+        for record, before in regressions:
+            print(
+                "REGRESSION {scale} {config} {cell}: p50 {now:.3f} ms, was {was:.3f} ms".format(
+                    now=record["p50_ms"], was=before["p50_ms"], **record
+                )
+            )
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
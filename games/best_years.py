@@ -0,0 +1,221 @@
+"""Parameterized "best years" queries as server-side prepared statements.
+
+In[22], In[24] and In[28] are one query with three knobs: the score
+column, how NULL scores are treated (left out of ``AVG``, or counted as 0
+via ``COALESCE``) and the join. In[24] and In[28] also hardcode the
+``HAVING COUNT(g.game) > 4`` threshold and ``LIMIT 10``. ``BestYears``
+prepares one statement per query shape, on first use, for each
+connection. It then binds the threshold, limit and slice value for every
+call, so a sweep over hundreds of combinations is never re-parsed.
+
+Prepared statements belong to the connection, not to a ``BestYears``.
+Before preparing, it checks ``pg_prepared_statements``, so a second
+``BestYears`` on the same connection reuses the first one's statements.
+A statement dropped behind its back, e.g. by ``DISCARD ALL`` when a pool
+resets the connection, is prepared again and the call retried.
+
+``sweep`` goes further and answers every threshold in a single pass. It
+aggregates per year (and per platform or publisher) once, joins the
+aggregates to the array of thresholds and ranks each threshold's years
+with ``ROW_NUMBER()``.
+
+The notebook's cells in these terms::
+
+    best = BestYears(conn)
+    best.top_years("critic", threshold=0, join="left")     # In[22]
+    best.top_years("critic", threshold=4, nulls="zero")    # In[24]
+    best.top_years("user", threshold=4)                    # In[28]
+    best.sweep("user", thresholds=range(1, 21), by="platform")
+"""
+
+import psycopg2.errors
+
+from . import results
+
+_PREFIX = "best_years_"
+
+METRICS = {"critic": "critic_score", "user": "user_score"}
+NULL_POLICIES = {"ignore": "r.{}", "zero": "COALESCE(r.{}, 0)"}
+JOINS = {"inner": "INNER JOIN", "left": "LEFT JOIN"}
+SLICES = {"platform": "g.platform", "publisher": "g.publisher"}
+
+
+def _check(name, value, choices):
+    if value not in choices:
+        raise ValueError(
+            "{} must be one of {}, not {!r}".format(
+                name, ", ".join(sorted(choices)), value
+            )
+        )
+
+
+def _score(metric, nulls):
+    _check("metric", metric, METRICS)
+    _check("nulls", nulls, NULL_POLICIES)
+    return NULL_POLICIES[nulls].format(METRICS[metric])
+
+
+def top_years_sql(metric, nulls, join, by):
+    """The prepared-statement body for one shape: $1 threshold, $2 limit, $3 slice value."""
+    _check("join", join, JOINS)
+    where = ""
+    if by is not None:
+        _check("by", by, SLICES)
+        where = "WHERE {} = $3\n".format(SLICES[by])
+    return (
+        "SELECT g.year,\n"
+        "       COUNT(g.game) AS num_games,\n"
+        "       ROUND(AVG({score}), 2) AS avg_{metric}_score\n"
+        "FROM game_sales AS g\n"
+        "{join} reviews AS r\n"
+        "ON g.game_id = r.game_id\n"
+        "{where}"
+        "GROUP BY g.year\n"
+        "HAVING COUNT(g.game) > $1\n"
+        "ORDER BY avg_{metric}_score DESC\n"
+        "LIMIT $2".format(
+            score=_score(metric, nulls), metric=metric, join=JOINS[join], where=where
+        )
+    )
+
+
+def sweep_sql(metric, nulls, join, by):
+    """The prepared-statement body ranking every threshold in $1 (int[]) at once, top $2."""
+    _check("join", join, JOINS)
+    slice_select = slice_group = slice_partition = slice_order = ""
+    if by is not None:
+        _check("by", by, SLICES)
+        slice_select = "{} AS {},\n           ".format(SLICES[by], by)
+        slice_group = ", {}".format(SLICES[by])
+        slice_partition = ", p.{}".format(by)
+        slice_order = "{}, ".format(by)
+    return (
+        "WITH per_year AS (\n"
+        "    SELECT g.year,\n"
+        "           {slice_select}COUNT(g.game) AS num_games,\n"
+        "           ROUND(AVG({score}), 2) AS avg_{metric}_score\n"
+        "    FROM game_sales AS g\n"
+        "    {join} reviews AS r\n"
+        "    ON g.game_id = r.game_id\n"
+        "    GROUP BY g.year{slice_group}\n"
+        "),\n"
+        "ranked AS (\n"
+        "    SELECT t.threshold,\n"
+        "           p.*,\n"
+        "           ROW_NUMBER() OVER (\n"
+        "               PARTITION BY t.threshold{slice_partition}\n"
+        "               ORDER BY p.avg_{metric}_score DESC\n"
+        "           ) AS rank\n"
+        "    FROM per_year AS p\n"
+        "    INNER JOIN unnest($1::int[]) AS t (threshold)\n"
+        "    ON p.num_games > t.threshold\n"
+        ")\n"
+        "SELECT *\n"
+        "FROM ranked\n"
+        "WHERE rank <= $2\n"
+        "ORDER BY threshold, {slice_order}rank".format(
+            slice_select=slice_select,
+            score=_score(metric, nulls),
+            metric=metric,
+            join=JOINS[join],
+            slice_group=slice_group,
+            slice_partition=slice_partition,
+            slice_order=slice_order,
+        )
+    )
+
+
+class BestYears:
+    """Prepared "best years" queries on one connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.prepared = set()
+
+    def _prepare(self, cur, name, types, sql):
+        cur.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (name,))
+        if cur.fetchone() is None:
+            cur.execute("PREPARE {} ({}) AS\n{}".format(name, ", ".join(types), sql))
+        self.prepared.add(name)
+
+    def _execute(self, kind, sql, types, shape, params):
+        name = "{}{}_{}".format(
+            _PREFIX, kind, "_".join(part or "all" for part in shape)
+        )
+        execute = "EXECUTE {} ({})".format(name, ", ".join(["%s"] * len(params)))
+        # Prepared statements outlive the transaction, so ending it after every
+        # call never idles the connection in a (possibly aborted) transaction.
+        try:
+            with self.conn.cursor() as cur:
+                if name not in self.prepared:
+                    self._prepare(cur, name, types, sql)
+                try:
+                    cur.execute(execute, params)
+                except psycopg2.errors.InvalidSqlStatementName:
+                    self.conn.rollback()
+                    self._prepare(cur, name, types, sql)
+                    cur.execute(execute, params)
+                keys = [column.name for column in cur.description]
+                return results.from_rows(keys, cur.fetchall())
+        finally:
+            self.conn.rollback()
+
+    def top_years(
+        self,
+        metric="critic",
+        threshold=4,
+        limit=10,
+        nulls="ignore",
+        join="inner",
+        platform=None,
+        publisher=None,
+    ):
+        """Top ``limit`` years by average score among years with more than ``threshold`` games.
+
+        Pass ``platform`` or ``publisher`` to restrict to one slice.
+        """
+        if platform is not None and publisher is not None:
+            raise ValueError("Slice by platform or publisher, not both")
+        by, value = None, None
+        if platform is not None:
+            by, value = "platform", platform
+        elif publisher is not None:
+            by, value = "publisher", publisher
+        sql = top_years_sql(metric, nulls, join, by)
+        types = ["int", "int"] + (["text"] if by else [])
+        params = [threshold, limit] + ([value] if by else [])
+        return self._execute("top", sql, types, (metric, nulls, join, by), params)
+
+    def sweep(
+        self,
+        metric="critic",
+        thresholds=range(1, 21),
+        limit=10,
+        nulls="ignore",
+        join="inner",
+        by=None,
+    ):
+        """Top ``limit`` years for every threshold in ``thresholds``, in one query.
+
+        Rows carry ``threshold`` and ``rank``, plus ``platform`` or
+        ``publisher`` when ``by`` names a slice column.
+        """
+        sql = sweep_sql(metric, nulls, join, by)
+        params = [list(thresholds), limit]
+        return self._execute(
+            "sweep", sql, ["int[]", "int"], (metric, nulls, join, by), params
+        )
+
+    def deallocate(self):
+        """Drop every ``BestYears`` statement prepared on this connection."""
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    "SELECT name FROM pg_prepared_statements WHERE starts_with(name, %s)",
+                    (_PREFIX,),
+                )
+                for (name,) in cur.fetchall():
+                    cur.execute("DEALLOCATE {}".format(name))
+        finally:
+            self.conn.rollback()
+        self.prepared.clear()
@@ -0,0 +1,276 @@
+"""Cached, dependency-tracked derived tables.
+
+In[26] and In[30] read ``top_critic_years``,
+``top_critic_years_more_than_four_games`` and
+``top_user_years_more_than_four_games``. These tables hold the results of
+In[22], In[24] and In[28]. ``DerivedTables`` records each table's defining
+query and the tables it reads. It rebuilds a table only when the query or
+one of its inputs has changed since the last build.
+
+An input's fingerprint starts with its OID, so a dropped and recreated
+table never matches. The rest is one of these:
+
+* its counter in ``table_versions``, when ``result_cache.install`` has
+  put the statement-level bump trigger on it. Every committed write
+  bumps the counter, whatever transaction IDs were involved;
+* otherwise, a content hash: the row count plus the sum of a 64-bit hash
+  of every row's text. That costs a full scan, which is cheap for the
+  derived tables themselves; run ``result_cache.install`` so that large
+  inputs such as ``game_sales`` use the counter instead.
+
+A derived table's fingerprint hashes its query together with the
+fingerprints of its inputs. It is stored in ``derived_table_builds`` next
+to the data, so a fresh notebook session still knows what is current. The derived table's own fingerprint is
+stored there too. A table that was dropped, or edited by hand since its
+build, is stale even if its inputs have not changed.
+
+Each input is fingerprinted once per ``stale`` or ``refresh`` call, however
+many derived tables read it.
+
+Usage::
+
+    from games import derived
+
+    tables = derived.case_study_tables()
+    tables.refresh(conn)              # rebuild whatever is stale
+    tables.refresh(conn, ["top_user_years_more_than_four_games"])
+"""
+
+import hashlib
+
+BUILDS_TABLE = "derived_table_builds"
+VERSIONS_TABLE = "table_versions"
+
+# The table's counter, if result_cache's bump trigger is on it and enabled.
+# The trigger bumps the row named after the table, so the bare name has to
+# resolve to this table.
+_VERSION_SQL = """
+SELECT v.version
+FROM pg_class AS c
+JOIN pg_trigger AS tr
+ON tr.tgrelid = c.oid
+AND tr.tgname = c.relname || '_bump_version'
+AND tr.tgenabled <> 'D'
+JOIN table_versions AS v
+ON v.table_name = c.relname
+WHERE c.oid = %(oid)s
+  AND to_regclass(quote_ident(c.relname)) = c.oid"""
+
+_BUILDS_DDL = """
+CREATE TABLE IF NOT EXISTS derived_table_builds (
+    name text PRIMARY KEY,
+    fingerprint text NOT NULL,
+    built_at timestamptz NOT NULL DEFAULT now()
+);
+ALTER TABLE derived_table_builds ADD COLUMN IF NOT EXISTS table_state text;"""
+
+
+class DerivedTable:
+    """A table defined by ``query`` over the tables named in ``sources``."""
+
+    def __init__(self, name, query, sources):
+        self.name = name
+        self.query = query.strip().rstrip(";")
+        self.sources = list(sources)
+
+    def __repr__(self):
+        return "DerivedTable({!r}, sources={!r})".format(self.name, self.sources)
+
+
+class DerivedTables:
+    """A registry of derived tables that rebuilds stale ones in dependency order."""
+
+    def __init__(self):
+        self.tables = {}
+
+    def register(self, name, query, sources):
+        """Record ``name`` as ``CREATE TABLE name AS query`` reading ``sources``."""
+        self.tables[name] = DerivedTable(name, query, sources)
+        return self.tables[name]
+
+    def order(self, names=None):
+        """Return ``names`` and everything they depend on, upstream first."""
+        if names is None:
+            names = list(self.tables)
+        ordered, visiting = [], set()
+
+        def visit(name):
+            if name in ordered or name not in self.tables:
+                return
+            if name in visiting:
+                raise ValueError("Derived table cycle through {!r}".format(name))
+            visiting.add(name)
+            for source in self.tables[name].sources:
+                visit(source)
+            visiting.discard(name)
+            ordered.append(name)
+
+        for name in names:
+            if name not in self.tables:
+                raise KeyError("Unknown derived table {!r}".format(name))
+            visit(name)
+        return ordered
+
+    def stale(self, conn, names=None):
+        """Return the tables in ``names`` that ``refresh`` would rebuild right now.
+
+        A table whose upstream table is stale is reported too, because
+        rebuilding the upstream table changes its fingerprint.
+        """
+        with conn.cursor() as cur:
+            built = _built_fingerprints(cur)
+            fingerprints = {}
+            stale = []
+            for name in self.order(names):
+                table = self.tables[name]
+                if any(
+                    source in stale for source in table.sources
+                ) or not self._current(cur, table, built, fingerprints):
+                    stale.append(name)
+        conn.rollback()
+        return stale
+
+    def refresh(self, conn, names=None, force=False):
+        """Rebuild the stale tables among ``names`` (default: all) and their inputs.
+
+        Each rebuild replaces the table and records its fingerprint in one
+        transaction. Returns the names of the tables that were rebuilt.
+        """
+        rebuilt = []
+        with conn.cursor() as cur:
+            cur.execute(_BUILDS_DDL)
+            conn.commit()
+            built = _built_fingerprints(cur)
+            fingerprints = {}
+            for name in self.order(names):
+                table = self.tables[name]
+                if not force and self._current(cur, table, built, fingerprints):
+                    continue
+                fingerprint = self._fingerprint(cur, table, fingerprints)
+                cur.execute("DROP TABLE IF EXISTS {}".format(name))
+                cur.execute("CREATE TABLE {} AS\n{}".format(name, table.query))
+                state = table_fingerprint(cur, name)
+                fingerprints[name] = state
+                cur.execute(
+                    "INSERT INTO derived_table_builds (name, fingerprint, table_state)\n"
+                    "VALUES (%s, %s, %s)\n"
+                    "ON CONFLICT (name) DO UPDATE\n"
+                    "SET fingerprint = EXCLUDED.fingerprint,\n"
+                    "    table_state = EXCLUDED.table_state,\n"
+                    "    built_at = now()",
+                    (name, fingerprint, state),
+                )
+                conn.commit()
+                rebuilt.append(name)
+        return rebuilt
+
+    def _current(self, cur, table, built, fingerprints):
+        """Whether ``table`` was built from its current inputs and is unchanged since."""
+        fingerprint, state = built.get(table.name, (None, None))
+        return (
+            state is not None
+            and fingerprint == self._fingerprint(cur, table, fingerprints)
+            and state == _memo_fingerprint(cur, table.name, fingerprints)
+        )
+
+    def _fingerprint(self, cur, table, fingerprints):
+        digest = hashlib.sha1(table.query.encode("utf-8"))
+        for source in sorted(table.sources):
+            digest.update(
+                "\0{}={}".format(
+                    source, _memo_fingerprint(cur, source, fingerprints)
+                ).encode("utf-8")
+            )
+        return digest.hexdigest()
+
+
+def table_fingerprint(cur, name):
+    """Return a fingerprint that changes on every committed write to ``name``.
+
+    ``"<oid>v<version>"`` from ``table_versions`` where its trigger is on
+    ``name``, else ``"<oid>h<rows>:<hash sum>"``; ``None`` if ``name`` does
+    not exist.
+    """
+    cur.execute("SELECT to_regclass(%s)::oid, to_regclass(%s)", (name, VERSIONS_TABLE))
+    oid, versions = cur.fetchone()
+    if oid is None:
+        return None
+    if versions is not None:
+        cur.execute(_VERSION_SQL, {"oid": oid})
+        row = cur.fetchone()
+        if row is not None:
+            return "{}v{}".format(oid, row[0])
+    cur.execute(
+        "SELECT COUNT(*),\n"
+        "       COALESCE(SUM(('x' || left(md5(t::text), 16))::bit(64)::bigint), 0)\n"
+        "FROM {} AS t".format(name)
+    )
+    rows, hashed = cur.fetchone()
+    return "{}h{}:{}".format(oid, rows, hashed)
+
+
+def _memo_fingerprint(cur, name, fingerprints):
+    if name not in fingerprints:
+        fingerprints[name] = table_fingerprint(cur, name)
+    return fingerprints[name]
+
+
+def _built_fingerprints(cur):
+    """``{name: (fingerprint, table_state)}``; builds recorded before ``table_state`` have None."""
+    cur.execute("SELECT to_regclass(%s)", (BUILDS_TABLE,))
+    if cur.fetchone()[0] is None:
+        return {}
+    cur.execute(
+        "SELECT name, fingerprint, to_jsonb(b) ->> 'table_state'\n"
+        "FROM derived_table_builds AS b"
+    )
+    return {name: (fingerprint, state) for name, fingerprint, state in cur.fetchall()}
+
+
+def case_study_tables():
+    """The derived tables read by In[26] and In[30], defined by In[22], In[24] and In[28]."""
+    tables = DerivedTables()
+    tables.register(
+        "top_critic_years",
+        """
+SELECT g.year,
+       ROUND(AVG(r.critic_score),2) AS avg_critic_score
+FROM game_sales AS g
+LEFT JOIN reviews AS r
+ON g.game_id = r.game_id
+GROUP BY g.year
+ORDER BY avg_critic_score DESC
+LIMIT 10""",
+        ["game_sales", "reviews"],
+    )
+    tables.register(
+        "top_critic_years_more_than_four_games",
+        """
+SELECT g.year,
+       COUNT(g.game) AS num_games,
+       ROUND(AVG(COALESCE(r.critic_score, 0)), 2) AS avg_critic_score -- NULL reviews as 0
+FROM game_sales AS g
+INNER JOIN reviews AS r
+ON g.game_id = r.game_id
+GROUP BY g.year
+HAVING COUNT(g.game) > 4
+ORDER BY avg_critic_score DESC
+LIMIT 10""",
+        ["game_sales", "reviews"],
+    )
+    tables.register(
+        "top_user_years_more_than_four_games",
+        """
+SELECT g.year,
+       COUNT(g.game) AS num_games,
+       ROUND(AVG(r.user_score),2) AS avg_user_score
+FROM game_sales AS g
+INNER JOIN reviews AS r
+ON g.game_id = r.game_id
+GROUP BY g.year
+HAVING COUNT(g.game) > 4
+ORDER BY avg_user_score DESC
+LIMIT 10""",
+        ["game_sales", "reviews"],
+    )
+    return tables
@@ -0,0 +1,252 @@
+"""Integer ``game_id`` join key and indexes for ``game_sales`` and ``reviews``.
+
+Out of the box every cell joins on the free-text ``game`` column. There
+are no indexes, so Postgres hashes or scans the wide text keys, and a title
+spelled slightly differently in the two tables silently misses its match.
+``install`` does the following:
+
+* adds ``normalize_title()``: lower case, with every run of characters
+  that are not letters or digits turned into a single space, then trimmed;
+* creates ``game_titles``, which gives each normalized title one
+  surrogate ``game_id``;
+* adds ``game_id`` to ``game_sales`` and ``reviews``, backfills it and
+  keeps it filled for new rows with a BEFORE trigger;
+* creates btree indexes on ``game_sales(year)``, ``game_sales(game_id)``
+  and ``reviews(game_id)``.
+
+Run it before ``year_summary.install``, or call ``year_summary.rebuild``
+afterwards, because the summary joins on ``game_id`` too.
+
+Because ``game_id`` is a new column, a ``SELECT *`` now returns it as well.
+In[19] therefore lists its six columns explicitly.
+
+Normalizing changes which rows join. A sales title can now match a review
+spelled slightly differently, which is the point. But two ``reviews`` rows
+whose titles normalize alike would both join every sales row of that game
+and double-count it. ``install`` refuses to commit when
+``title_collisions`` finds any. ``compare_joins`` lists the cells whose
+output differs between the ``game`` and ``game_id`` joins. Run it on the
+case-study data to confirm the asserted results (31, 9.32, 175.07, ...)
+are unchanged.
+
+``explain_timings`` reports ``EXPLAIN ANALYZE`` timings for each cell
+joined on ``game`` and on ``game_id``.
+"""
+
+import json
+
+SETUP = """
+CREATE OR REPLACE FUNCTION normalize_title(title text) RETURNS text
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT btrim(regexp_replace(lower(title), '[^[:alnum:]]+', ' ', 'g'))
+$$;
+
+CREATE TABLE IF NOT EXISTS game_titles (
+    game_id serial PRIMARY KEY,
+    normalized_title text NOT NULL UNIQUE
+);
+
+INSERT INTO game_titles (normalized_title)
+SELECT normalize_title(game) FROM game_sales WHERE game IS NOT NULL
+UNION
+SELECT normalize_title(game) FROM reviews WHERE game IS NOT NULL
+ON CONFLICT (normalized_title) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION assign_game_id() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.game IS NULL THEN
+        NEW.game_id := NULL;
+        RETURN NEW;
+    END IF;
+    INSERT INTO game_titles (normalized_title)
+    VALUES (normalize_title(NEW.game))
+    ON CONFLICT (normalized_title) DO NOTHING;
+    SELECT game_id INTO NEW.game_id
+    FROM game_titles
+    WHERE normalized_title = normalize_title(NEW.game);
+    RETURN NEW;
+END
+$$;
+"""
+
+_TABLE_SETUP = """
+ALTER TABLE {0} ADD COLUMN IF NOT EXISTS game_id int REFERENCES game_titles (game_id);
+
+UPDATE {0} AS x
+SET game_id = t.game_id
+FROM game_titles AS t
+WHERE t.normalized_title = normalize_title(x.game)
+  AND x.game_id IS DISTINCT FROM t.game_id;
+
+DROP TRIGGER IF EXISTS {0}_assign_game_id ON {0};
+CREATE TRIGGER {0}_assign_game_id BEFORE INSERT OR UPDATE OF game ON {0}
+FOR EACH ROW EXECUTE FUNCTION assign_game_id();
+
+CREATE INDEX IF NOT EXISTS {0}_game_id_idx ON {0} (game_id);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS game_sales_year_idx ON game_sales (year);
+ANALYZE game_titles;
+ANALYZE game_sales;
+ANALYZE reviews;
+"""
+
+
+COLLISIONS = """
+SELECT t.normalized_title, array_agg(DISTINCT r.game ORDER BY r.game)
+FROM reviews AS r
+JOIN game_titles AS t
+ON t.game_id = r.game_id
+GROUP BY t.normalized_title
+HAVING COUNT(DISTINCT r.game) > 1
+ORDER BY t.normalized_title;"""
+
+
+def install(conn):
+    """Add ``game_titles``, the ``game_id`` columns and the indexes, and backfill.
+
+    Raises ``ValueError`` and rolls everything back if distinct ``reviews``
+    titles would share a ``game_id``.
+    """
+    with conn.cursor() as cur:
+        cur.execute(SETUP)
+        for table in ("game_sales", "reviews"):
+            cur.execute(_TABLE_SETUP.format(table))
+        cur.execute(INDEXES)
+        cur.execute(COLLISIONS)
+        collisions = cur.fetchall()
+    if collisions:
+        conn.rollback()
+        raise ValueError(
+            "reviews titles that normalize alike would double-count sales rows: {}".format(
+                "; ".join(
+                    "{!r} <- {}".format(title, ", ".join(map(repr, games)))
+                    for title, games in collisions[:10]
+                )
+            )
+        )
+    conn.commit()
+
+
+def title_collisions(conn):
+    """``[(normalized_title, [review titles])]`` for titles that share a ``game_id``."""
+    with conn.cursor() as cur:
+        cur.execute(COLLISIONS)
+        collisions = cur.fetchall()
+    conn.rollback()
+    return collisions
+
+
+# The notebook's join cells as rewritten to use the integer key.
+QUERIES = {
+    "In[20]": """
+SELECT COUNT(*)
+FROM game_sales AS g
+LEFT JOIN reviews AS r
+ON g.game_id = r.game_id
+WHERE r.critic_score IS NULL AND r.user_score IS NULL;""",
+    "In[22]": """
+SELECT g.year,
+       ROUND(AVG(r.critic_score),2) AS avg_critic_score
+FROM game_sales AS g
+LEFT JOIN reviews AS r
+ON g.game_id = r.game_id
+GROUP BY g.year
+ORDER BY avg_critic_score DESC
+LIMIT 10;""",
+    "In[24]": """
+SELECT g.year,
+       ROUND(AVG(COALESCE(r.critic_score, 0)), 2) AS avg_critic_score, -- NULL reviews as 0
+       COUNT(g.game) AS num_games
+FROM game_sales AS g
+INNER JOIN reviews AS r
+ON g.game_id = r.game_id
+GROUP BY g.year
+HAVING COUNT(g.game) > 4
+ORDER BY avg_critic_score DESC
+LIMIT 10;""",
+    "In[28]": """
+SELECT g.year,
+       COUNT(g.game) AS num_games,
+       ROUND(AVG(r.user_score),2) AS avg_user_score
+FROM game_sales AS g
+INNER JOIN reviews AS r
+ON g.game_id = r.game_id
+GROUP BY g.year
+HAVING COUNT(g.game) > 4
+ORDER BY avg_user_score DESC
+LIMIT 10;""",
+    "In[32]": """
+SELECT g.year,
+       SUM(g.games_sold) AS total_games_sold
+FROM game_sales AS g
+INNER JOIN reviews AS r
+ON g.game_id = r.game_id
+WHERE g.year IN (1998 , 2002 , 2008)
+GROUP BY g.year
+ORDER BY total_games_sold DESC""",
+}
+
+# The same cells joined on the title, as the notebook originally ran them.
+TEXT_JOIN_QUERIES = {
+    cell: query.replace("ON g.game_id = r.game_id", "ON g.game = r.game")
+    for cell, query in QUERIES.items()
+}
+
+
+def compare_joins(conn):
+    """Return ``[(cell, game_rows, game_id_rows)]`` for cells whose output differs.
+
+    An empty list means every cell returns the same rows, in the same order,
+    on either join key.
+    """
+    differences = []
+    with conn.cursor() as cur:
+        for cell in QUERIES:
+            outputs = []
+            for query in (TEXT_JOIN_QUERIES[cell], QUERIES[cell]):
+                cur.execute(query)
+                outputs.append(cur.fetchall())
+            if outputs[0] != outputs[1]:
+                differences.append((cell, outputs[0], outputs[1]))
+    conn.rollback()
+    return differences
+
+
+def explain(cur, query):
+    """Return ``(planning_ms, execution_ms, plan)`` from ``EXPLAIN ANALYZE`` of ``query``."""
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON)\n" + query.strip().rstrip(";"))
+    result = cur.fetchone()[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]["Planning Time"], result[0]["Execution Time"], result[0]["Plan"]
+
+
+def explain_timings(conn, repeat=3):
+    """Time every cell on the ``game`` and ``game_id`` joins.
+
+    Returns a list of ``(cell, text_join_ms, game_id_join_ms)`` tuples. Each
+    time is the best of ``repeat`` runs of planning plus execution.
+    """
+    timings = []
+    with conn.cursor() as cur:
+        for cell in QUERIES:
+            best = []
+            for query in (TEXT_JOIN_QUERIES[cell], QUERIES[cell]):
+                runs = [sum(explain(cur, query)[:2]) for _ in range(repeat)]
+                best.append(min(runs))
+            timings.append((cell, best[0], best[1]))
+    conn.rollback()
+    return timings
+
+
+def print_timings(timings):
+    print("{:<8} {:>12} {:>12} {:>8}".format("cell", "game (ms)", "game_id (ms)", "speedup"))
+    for cell, before, after in timings:
+        print(
+            "{:<8} {:>12.3f} {:>12.3f} {:>7.1f}x".format(
+                cell, before, after, before / after if after else float("inf")
+            )
+        )
@@ -0,0 +1,193 @@
+"""Read the ``%%sql`` and ``%%nose`` cells out of the exported notebook.
+
+``notebook (4).py`` is a plain-Python export: each cell is a
+``get_ipython().run_cell_magic(magic, line, body)`` call, preceded by an
+``# In[N]:`` marker. ``read_cells`` returns those calls without running
+them. ``pair_tests`` matches each ``%%nose`` cell to the ``%%sql`` cell
+whose output it checks.
+"""
+
+import ast
+import collections
+import os
+import re
+
+NOTEBOOK = os.path.join(os.path.dirname(os.path.dirname(__file__)), "notebook (4).py")
+
+Cell = collections.namedtuple("Cell", ["label", "magic", "line", "body"])
+
+_MARKER = re.compile(r"^# (In\[\d*\]):\s*$")
+_CONNECTION = re.compile(r"^\s*\w+(\+\w+)?://\S*\s*$")
+# Whitespace and comments are skipped; literals, names and symbols are tokens.
+_SQL_TOKEN = re.compile(
+    r"\s+|--[^\n]*|/\*.*?\*/"
+    r"|(?P<literal>(?<![\w$])[Ee]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'"
+    r"|\$(?P<tag>[A-Za-z_]\w*|)\$.*?\$(?P=tag)\$|\d[\w.]*)"
+    r"|(?P<name>\"(?:[^\"]|\"\")+\"|[A-Za-z_][\w$]*)"
+    r"|(?P<symbol>.)",
+    re.S,
+)
+# Keywords that end a FROM list at the same parenthesis depth.
+_FROM_END = {
+    "where",
+    "group",
+    "order",
+    "having",
+    "limit",
+    "offset",
+    "fetch",
+    "for",
+    "window",
+    "union",
+    "except",
+    "intersect",
+    "returning",
+    "select",
+    "values",
+}
+_QUERY_START = {"select", "with", "values"}
+
+
+def read_cells(path=NOTEBOOK):
+    """Return the notebook's cell magics as ``Cell`` tuples, in notebook order."""
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    markers = {}
+    label = None
+    for number, text in enumerate(source.splitlines(), 1):
+        match = _MARKER.match(text)
+        if match:
+            label = match.group(1)
+        markers[number] = label
+
+    cells = []
+    for node in ast.parse(source).body:
+        if not isinstance(node, ast.Expr) or not isinstance(node.value, ast.Call):
+            continue
+        call = node.value
+        if getattr(call.func, "attr", None) != "run_cell_magic":
+            continue
+        magic, line, body = (ast.literal_eval(arg) for arg in call.args)
+        cells.append(Cell(markers[node.lineno], magic, line, body))
+    return cells
+
+
+def split_connection(body):
+    """Split a ``%%sql`` body into ``(connection_string_or_None, sql)``.
+
+    ipython-sql takes a connection string on the first line of the cell,
+    as In[19] does with ``postgresql:///games``.
+    """
+    lines = body.lstrip("\n").split("\n", 1)
+    if _CONNECTION.match(lines[0]):
+        return lines[0].strip(), lines[1] if len(lines) > 1 else ""
+    return None, body
+
+
+def _identifier(name):
+    """``name`` as Postgres folds it, still quoted where the quotes matter."""
+    if not name.startswith('"'):
+        return name.lower()
+    unquoted = name[1:-1].replace('""', '"')
+    if re.match(r"^[a-z_][a-z0-9_$]*$", unquoted):
+        return unquoted
+    return name
+
+
+def _sql_tokens(sql):
+    tokens = []
+    for match in _SQL_TOKEN.finditer(sql):
+        for kind in ("literal", "name", "symbol"):
+            if match.group(kind) is not None:
+                tokens.append((kind, match.group(kind)))
+                break
+    return tokens
+
+
+def referenced_tables(sql):
+    """Names of the tables a query reads, from its FROM and JOIN clauses.
+
+    Handles schema-qualified and quoted names, comma-separated FROM items
+    and subqueries, and leaves out the query's own CTE names. A qualified
+    name is returned dotted, e.g. ``public.game_sales``; a name whose case
+    matters keeps its quotes, so each one can go straight to ``to_regclass``.
+    """
+    tokens = _sql_tokens(sql)
+    words = [
+        text.lower() if kind == "name" and not text.startswith('"') else None
+        for kind, text in tokens
+    ]
+    tables, ctes = set(), set()
+    # One frame per parenthesis depth: is it a query, inside its FROM list,
+    # still in its WITH list?
+    frames = [{"query": True, "from": False, "with": False}]
+    expect = False
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        word, frame = words[i], frames[-1]
+        following = words[i + 1] if i + 1 < len(tokens) else None
+        if kind == "symbol" and text == "(":
+            nested_from = expect and following not in _QUERY_START
+            frames.append(
+                {
+                    "query": expect or following in _QUERY_START,
+                    "from": nested_from,
+                    "with": False,
+                }
+            )
+            expect = nested_from
+        elif kind == "symbol" and text == ")":
+            if len(frames) > 1:
+                frames.pop()
+            expect = False
+        elif not frame["query"]:
+            pass
+        elif word == "with":
+            frame["with"] = True
+        elif word in ("from", "join"):
+            # IS [NOT] DISTINCT FROM compares values.
+            expect = word == "join" or i == 0 or words[i - 1] != "distinct"
+            frame["from"] = frame["from"] or expect
+        elif word in _FROM_END:
+            frame["from"] = expect = False
+            if word == "select":
+                frame["with"] = False
+        elif kind == "symbol" and text == ",":
+            expect = frame["from"]
+        elif expect and word in ("only", "lateral"):
+            pass
+        elif expect and kind == "name":
+            parts = [_identifier(text)]
+            while (
+                i + 2 < len(tokens)
+                and tokens[i + 1] == ("symbol", ".")
+                and tokens[i + 2][0] == "name"
+            ):
+                parts.append(_identifier(tokens[i + 2][1]))
+                i += 2
+            tables.add(".".join(parts))
+            expect = False
+        elif frame["with"] and kind == "name" and following in ("as", None):
+            if following == "as" or tokens[i + 1 :][:1] == [("symbol", "(")]:
+                ctes.add(_identifier(text))
+        else:
+            expect = False
+        i += 1
+    return sorted(tables - ctes)
+
+
+def pair_tests(cells):
+    """Return ``[(sql_cell, nose_cell)]``.
+
+    Each ``%%nose`` cell checks ``_``, the output of the nearest earlier
+    ``%%sql`` cell that has no test yet. That is how In[34] ends up
+    checking In[19].
+    """
+    pairs, untested = [], []
+    for cell in cells:
+        if cell.magic == "sql":
+            untested.append(cell)
+        elif cell.magic == "nose" and untested:
+            pairs.append((untested.pop(), cell))
+    return pairs
@@ -0,0 +1,320 @@
+"""Per-cell profiling and EXPLAIN instrumentation for the ``%%sql`` cells.
+
+When a cell is slow, the wall time alone does not show whether the time
+went to the join on ``game``, the GROUP BY year sort, the
+Decimal-to-DataFrame conversion or the network. ``Profiler.fetch`` runs a
+statement through ``results.stream_rows``, the same named-cursor,
+batched path the runner takes without profiling, and records these parts:
+
+* ``execute_ms`` and ``fetch_ms``: client-side wall time to run the
+  statement and read its rows, in batches for a SELECT;
+* ``server_ms`` and the plan, with ``server_source`` saying where they
+  came from (see below);
+* ``network_ms``: the wall time that ``server_ms`` does not explain;
+* ``convert_ms``: parsing each batch into arrays, and building the
+  ``Result`` and its DataFrame;
+* ``rows``: the number of rows fetched.
+
+Only ``SELECT`` and ``WITH`` statements are explained. Where the role may
+``LOAD 'auto_explain'``, or it is preloaded, the plan and ``server_ms``
+come from the same execution that fetched the rows. ``auto_explain``
+sends them back as a NOTICE, and ``server_source`` is ``"auto_explain"``.
+``server_ms`` is then the executor time, which includes writing the rows
+to the socket. Otherwise the statement runs a second time under
+``EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)``, and ``server_source`` is
+``"explain_rerun"``. That run usually finds a warm cache, so
+``network_ms`` compares two different executions and is only an
+estimate. ``print_profile`` marks such values with ``~``.
+
+``check_plan`` flags the plan shapes that hurt these queries: filtered
+sequential scans of ``reviews``, sequential scans of ``reviews`` repeated
+as the inner side of a nested loop, and sorts, aggregates or hash joins
+that spill to disk. A plain full scan of ``reviews`` feeding a hash join
+is the right plan for these whole-table queries and is not flagged.
+
+``write_chrome_trace`` exports the run in the Chrome trace event format,
+for ``chrome://tracing`` or Perfetto. Each cell's client phases and plan
+nodes appear as nested spans.
+
+Usage::
+
+    python -m games.runner --trace trace.json
+"""
+
+import json
+import re
+import threading
+import time
+
+import psycopg2
+
+from . import results
+
+_EXPLAINABLE = re.compile(r"^\s*(?:--[^\n]*\n\s*)*(SELECT|WITH)\b", re.I)
+
+_AUTO_EXPLAIN_PLAN = re.compile(r"duration: ([\d.]+) ms\s+plan:\s*\n(.*)", re.S)
+
+# SET LOCAL, because callers roll back after every read.
+_AUTO_EXPLAIN_SETTINGS = """
+SET LOCAL auto_explain.log_min_duration = 0;
+SET LOCAL auto_explain.log_analyze = on;
+SET LOCAL auto_explain.log_buffers = on;
+SET LOCAL auto_explain.log_format = json;
+SET LOCAL auto_explain.log_level = notice;
+SET LOCAL client_min_messages = notice;"""
+
+# Seq scans of these tables mean the game_id index is not being used, when
+# they filter rows or repeat once per outer row of a nested loop.
+INDEXED_TABLES = ("reviews",)
+
+
+def check_plan(plan, parent=None):
+    """Return human-readable warnings for one ``EXPLAIN (ANALYZE, FORMAT JSON)`` plan node tree."""
+    flags = []
+    node_type = plan.get("Node Type", "")
+    if node_type == "Seq Scan" and plan.get("Relation Name") in INDEXED_TABLES:
+        if "Filter" in plan:
+            flags.append(
+                "filtered seq scan on {} ({} rows, {} removed)".format(
+                    plan["Relation Name"],
+                    plan.get("Actual Rows", "?"),
+                    plan.get("Rows Removed by Filter", "?"),
+                )
+            )
+        elif parent == "Nested Loop" and plan.get("Parent Relationship") == "Inner":
+            flags.append(
+                "seq scan on {} repeated {} times inside a nested loop".format(
+                    plan["Relation Name"], plan.get("Actual Loops", "?")
+                )
+            )
+    if plan.get("Sort Space Type") == "Disk":
+        flags.append(
+            "{} spilled {} kB to disk ({})".format(
+                node_type, plan.get("Sort Space Used"), plan.get("Sort Method")
+            )
+        )
+    if plan.get("Disk Usage", 0) > 0 or plan.get("HashAgg Batches", 1) > 1:
+        flags.append(
+            "{} spilled {} kB to disk in {} batches".format(
+                node_type, plan.get("Disk Usage", 0), plan.get("HashAgg Batches", 1)
+            )
+        )
+    if node_type == "Hash" and plan.get("Hash Batches", 1) > 1:
+        flags.append(
+            "hash join spilled to disk in {} batches".format(plan["Hash Batches"])
+        )
+    for child in plan.get("Plans", []):
+        flags.extend(check_plan(child, node_type))
+    return flags
+
+
+def _auto_explain_plan(notices):
+    """``(server_ms, plan)`` from the last ``auto_explain`` NOTICE, or ``None``."""
+    for notice in reversed(notices):
+        match = _AUTO_EXPLAIN_PLAN.search(notice)
+        if match:
+            try:
+                explained = json.loads(match.group(2))
+            except ValueError:
+                return None
+            return float(match.group(1)), explained["Plan"]
+    return None
+
+
+class Profiler:
+    """Collects one record per profiled statement; safe to share across threads."""
+
+    def __init__(self, explain=True):
+        self.explain = explain
+        self.records = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        # id() of connections that cannot LOAD auto_explain.
+        self._without_auto_explain = set()
+
+    def _now_us(self):
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def _auto_explain(self, cur):
+        """Turn on ``auto_explain`` for this transaction; False if it is unavailable."""
+        conn = cur.connection
+        if conn.autocommit or id(conn) in self._without_auto_explain:
+            return False
+        cur.execute("SELECT current_setting('auto_explain.log_min_duration', true)")
+        if cur.fetchone()[0] is None:
+            cur.execute("SAVEPOINT profiling_auto_explain")
+            try:
+                cur.execute("LOAD 'auto_explain'")
+            except psycopg2.Error:
+                cur.execute("ROLLBACK TO SAVEPOINT profiling_auto_explain")
+                with self._lock:
+                    self._without_auto_explain.add(id(conn))
+                return False
+            cur.execute("RELEASE SAVEPOINT profiling_auto_explain")
+        cur.execute(_AUTO_EXPLAIN_SETTINGS)
+        del conn.notices[:]
+        return True
+
+    def fetch(self, cur, sql, label=None):
+        """Run ``sql`` on ``cur``, record where the time went and return the ``Result``.
+
+        It has the ``fetch(cur, sql)`` signature that
+        ``result_cache.ResultCache.execute`` takes.
+        """
+        record = {"label": label, "sql": sql, "start_us": self._now_us()}
+        explainable = self.explain and _EXPLAINABLE.match(sql)
+        auto = explainable and self._auto_explain(cur)
+        timings = {}
+        result = results.stream_rows(cur, sql, timings)
+        record["rows"] = 0
+        if result is not None:
+            start = time.perf_counter()
+            result.DataFrame()
+            timings["convert"] = timings.get("convert", 0.0) + (
+                time.perf_counter() - start
+            )
+            record["rows"] = len(result)
+        for phase in ("execute", "fetch", "convert"):
+            record[phase + "_ms"] = timings.get(phase, 0.0) * 1000.0
+        record["wall_ms"] = record["execute_ms"] + record["fetch_ms"]
+
+        record["plan"], record["flags"] = None, []
+        same_run = _auto_explain_plan(cur.connection.notices) if auto else None
+        if same_run is not None:
+            record["server_ms"], record["plan"] = same_run
+            record["server_source"] = "auto_explain"
+        elif explainable:
+            cur.execute(
+                "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)\n" + sql.strip().rstrip(";")
+            )
+            explained = cur.fetchone()[0]
+            if isinstance(explained, str):
+                explained = json.loads(explained)
+            explained = explained[0]
+            record["plan"] = explained["Plan"]
+            record["server_ms"] = (
+                explained["Planning Time"] + explained["Execution Time"]
+            )
+            record["server_source"] = "explain_rerun"
+        if record["plan"] is not None:
+            record["network_ms"] = max(0.0, record["wall_ms"] - record["server_ms"])
+            record["flags"] = check_plan(record["plan"])
+        with self._lock:
+            self.records.append(record)
+        return result
+
+    def flags(self):
+        """``[(label, flag)]`` for every warning raised so far."""
+        return [(r["label"], flag) for r in self.records for flag in r["flags"]]
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.records, f, indent=2, default=str)
+
+    def chrome_trace(self):
+        """The records as a Chrome trace event dict (``{"traceEvents": [...]}``)."""
+        events = []
+        for tid, record in enumerate(self.records, 1):
+            name = record["label"] or "statement {}".format(tid)
+            start = record["start_us"]
+            total = (record["wall_ms"] + record["convert_ms"]) * 1000.0
+            events.append(
+                _span(
+                    name,
+                    "cell",
+                    start,
+                    total,
+                    tid,
+                    {
+                        key: record.get(key)
+                        for key in (
+                            "rows",
+                            "server_ms",
+                            "server_source",
+                            "network_ms",
+                            "flags",
+                            "sql",
+                        )
+                    },
+                )
+            )
+            phase_start = start
+            for phase in ("execute", "fetch", "convert"):
+                duration = record[phase + "_ms"] * 1000.0
+                events.append(_span(phase, "client", phase_start, duration, tid))
+                phase_start += duration
+            if record["plan"] is not None:
+                _plan_spans(record["plan"], start, tid, events)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+
+def _span(name, category, start_us, duration_us, tid, args=None):
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": start_us,
+        "dur": duration_us,
+        "pid": 1,
+        "tid": tid,
+    }
+    if args:
+        event["args"] = args
+    return event
+
+
+def _plan_spans(plan, origin_us, tid, events):
+    """Plan nodes as spans under the execute phase, placed by their actual times."""
+    startup = plan.get("Actual Startup Time", 0.0) * 1000.0
+    total = plan.get("Actual Total Time", 0.0) * 1000.0
+    name = plan["Node Type"]
+    if "Relation Name" in plan:
+        name = "{} on {}".format(name, plan["Relation Name"])
+    args = {
+        key: plan[key]
+        for key in (
+            "Actual Rows",
+            "Actual Loops",
+            "Shared Hit Blocks",
+            "Shared Read Blocks",
+            "Temp Written Blocks",
+            "Sort Method",
+            "Sort Space Used",
+            "Sort Space Type",
+            "Peak Memory Usage",
+            "Disk Usage",
+        )
+        if key in plan
+    }
+    events.append(
+        _span(name, "plan", origin_us + startup, max(total - startup, 0.0), tid, args)
+    )
+    for child in plan.get("Plans", []):
+        _plan_spans(child, origin_us, tid, events)
+
+
+def print_profile(records):
+    print(
+        "{:<8} {:>10} {:>10} {:>10} {:>10} {:>8}".format(
+            "cell", "wall ms", "server ms", "network ms", "convert ms", "rows"
+        )
+    )
+    for r in records:
+        # A separate EXPLAIN ANALYZE run makes the split only an estimate.
+        mark = "~" if r.get("server_source") == "explain_rerun" else ""
+        print(
+            "{:<8} {:>10.3f} {:>10} {:>10} {:>10.3f} {:>8}".format(
+                r["label"] or "-",
+                r["wall_ms"],
+                mark + "{:.3f}".format(r["server_ms"]) if "server_ms" in r else "-",
+                mark + "{:.3f}".format(r["network_ms"]) if "network_ms" in r else "-",
+                r["convert_ms"],
+                r["rows"],
+            )
+        )
+        for flag in r["flags"]:
+            print("    PLAN {}".format(flag))
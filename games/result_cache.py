@@ -0,0 +1,310 @@
+"""On-disk query result cache keyed by normalized SQL and table versions.
+
+A notebook rerun, or rerunning one cell while iterating on its ``%%nose``
+tests, sends the same SQL against unchanged tables again and again.
+``ResultCache`` answers a query from disk when nothing it reads has
+changed since the result was stored.
+
+The key is a hash of the database's identity, the normalized SQL text
+and a version stamp for each table the query reads. Normalizing drops
+comments and case/whitespace differences outside string literals; the
+literals, including ``E'...'`` and ``$tag$...$tag$`` ones, are kept byte
+for byte. The identity is the cluster's system identifier (where the
+role may read it), the database name and its OID, so two databases, or a
+dropped and recreated one, never share keys in the same cache directory.
+
+The tables come from ``notebook.referenced_tables`` and are resolved with
+``to_regclass``. A query naming anything that does not resolve, such as
+a function or a table that does not exist yet, is run but not cached.
+Each stamp starts with the table's OID. The rest comes from the first of
+these that applies:
+
+* ``game_sales`` and ``reviews``: a counter in ``table_versions``, bumped
+  by a statement-level trigger on every write. ``install`` sets this up.
+* the ``top_*`` tables: their input fingerprint and ``table_state`` in
+  ``derived_table_builds``, which ``derived`` rewrites on every rebuild;
+* anything else: ``derived.table_fingerprint``.
+
+The first two only apply to the table that the bare name resolves to,
+and include the OID of the bookkeeping table, because a recreated
+``table_versions`` starts counting from 1 again.
+
+Each result is stored as its column arrays, pickled and zlib-compressed,
+in one file per key. The newest results are kept up to ``max_bytes`` in
+total, and the least recently used are evicted first. ``stats`` counts
+hits, misses, stores and evictions.
+
+Usage::
+
+    cache = ResultCache()
+    result = cache.execute(conn, "SELECT COUNT(*) FROM game_sales ...")
+    runner.run_notebook(cache=cache)
+"""
+
+import collections
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+import zlib
+
+from . import derived, notebook, results
+
+DEFAULT_DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "games-sql"
+)
+
+VERSIONED_TABLES = ("game_sales", "reviews")
+
+INSTALL = """
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name text PRIMARY KEY,
+    version bigint NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO table_versions (table_name, version)
+    VALUES (TG_TABLE_NAME, 1)
+    ON CONFLICT (table_name) DO UPDATE
+    SET version = table_versions.version + 1;
+    RETURN NULL;
+END
+$$;
+"""
+
+_TRIGGER = """
+INSERT INTO table_versions (table_name) VALUES ('{0}') ON CONFLICT DO NOTHING;
+DROP TRIGGER IF EXISTS {0}_bump_version ON {0};
+CREATE TRIGGER {0}_bump_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {0}
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+"""
+
+_TOKENS = re.compile(
+    r"((?<![\w$])[Ee]'(?:[^'\\]|\\.|'')*'"  # escape string literals
+    r"|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\""  # string literals and quoted names
+    r"|\$(?P<tag>[A-Za-z_]\w*|)\$.*?\$(?P=tag)\$)"  # dollar-quoted literals
+    r"|(--[^\n]*|/\*.*?\*/)",  # comments
+    re.S,
+)
+
+# The bookkeeping tables that stamp a table by its bare name.
+_STAMP_SOURCES = (
+    ("table_versions", "table_name", "version::text"),
+    (
+        "derived_table_builds",
+        "name",
+        "fingerprint || '/' || (to_jsonb(b) ->> 'table_state')",
+    ),
+)
+
+
+def install(conn, tables=VERSIONED_TABLES):
+    """Create ``table_versions`` and the triggers that bump it on writes to ``tables``."""
+    with conn.cursor() as cur:
+        cur.execute(INSTALL)
+        for table in tables:
+            cur.execute(_TRIGGER.format(table))
+    conn.commit()
+
+
+def _collapse(segments):
+    return re.sub(r"\s+", " ", "".join(segments).lower())
+
+
+def normalize_sql(sql):
+    """Lower-case ``sql`` and collapse whitespace and comments outside quotes."""
+    parts, outside, position = [], [], 0
+    for match in _TOKENS.finditer(sql):
+        outside.append(sql[position : match.start()])
+        if match.group(1):
+            parts.append(_collapse(outside))
+            parts.append(match.group(1))
+            outside = []
+        else:
+            outside.append(" ")
+        position = match.end()
+    outside.append(sql[position:])
+    parts.append(_collapse(outside))
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def database_identity(cur):
+    """``"system_identifier/name/oid"`` for the connected database."""
+    cur.execute(
+        "SELECT current_database(), d.oid,\n"
+        "       has_function_privilege('pg_control_system()', 'EXECUTE')\n"
+        "FROM pg_database AS d\n"
+        "WHERE d.datname = current_database()"
+    )
+    name, oid, can_read_control = cur.fetchone()
+    system = ""
+    if can_read_control:
+        cur.execute("SELECT system_identifier FROM pg_control_system()")
+        system = cur.fetchone()[0]
+    return "{}/{}/{}".format(system, name, oid)
+
+
+def table_stamps(cur, tables):
+    """Return ``{table: stamp}`` for ``tables``, or None if one of them does not resolve."""
+    # table -> (oid, bare name if it resolves to the same table, else None)
+    resolved = {}
+    for table in tables:
+        cur.execute(
+            "SELECT c.oid,\n"
+            "       CASE WHEN to_regclass(quote_ident(c.relname)) = c.oid\n"
+            "            THEN c.relname END\n"
+            "FROM pg_class AS c\n"
+            "WHERE c.oid = to_regclass(%s)",
+            (table,),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        resolved[table] = row
+
+    bare = {name: table for table, (_, name) in resolved.items() if name is not None}
+    stamps = {}
+    for source, name_column, stamp_column in _STAMP_SOURCES:
+        cur.execute("SELECT to_regclass(%s)::oid", (source,))
+        source_oid = cur.fetchone()[0]
+        if source_oid is None or not bare:
+            continue
+        cur.execute(
+            "SELECT {1}, {2} FROM {0} AS b WHERE {1} = ANY(%s)".format(
+                source, name_column, stamp_column
+            ),
+            (list(bare),),
+        )
+        for name, stamp in cur.fetchall():
+            if stamp is not None:
+                stamps.setdefault(
+                    bare[name], "{}@{}:{}".format(source, source_oid, stamp)
+                )
+    for table in tables:
+        if table not in stamps:
+            stamps[table] = "rows:{}".format(derived.table_fingerprint(cur, table))
+        stamps[table] = "{}#{}".format(resolved[table][0], stamps[table])
+    return stamps
+
+
+class ResultCache:
+    """A size-bounded LRU cache of query results on disk."""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # path -> size, least recently used first (by file mtime, touched on hits).
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(".result"):
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        self._entries = collections.OrderedDict(
+            (path, size) for _, path, size in sorted(entries)
+        )
+        self._bytes = sum(self._entries.values())
+
+    def key(self, sql, stamps, database=""):
+        digest = hashlib.sha256(database.encode("utf-8"))
+        digest.update(b"\0" + normalize_sql(sql).encode("utf-8"))
+        for table in sorted(stamps):
+            digest.update("\0{}={}".format(table, stamps[table]).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".result")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                keys, columns = pickle.loads(zlib.decompress(f.read()))
+        except (OSError, EOFError, pickle.UnpicklingError, zlib.error):
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        now = time.time()
+        os.utime(path, (now, now))
+        with self._lock:
+            self.stats["hits"] += 1
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        return results.Result(keys, columns)
+
+    def put(self, key, result):
+        blob = zlib.compress(
+            pickle.dumps(
+                (result.keys, result.columns), protocol=pickle.HIGHEST_PROTOCOL
+            )
+        )
+        if len(blob) > self.max_bytes:
+            return
+        path = self._path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        with self._lock:
+            self._bytes += len(blob) - self._entries.pop(path, 0)
+            self._entries[path] = len(blob)
+            self.stats["stores"] += 1
+            while self._bytes > self.max_bytes:
+                old, size = self._entries.popitem(last=False)
+                self._bytes -= size
+                self.stats["evictions"] += 1
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def execute(self, conn, sql, fetch=None):
+        """Return the result of ``sql`` from the cache, or run it and store it.
+
+        ``fetch(cur, sql)`` runs the query on a cache miss. By default it
+        returns the rows as the driver gives them, via ``results.from_rows``.
+        A query that reads something ``table_stamps`` cannot stamp is run
+        every time and counted under ``stats["uncacheable"]``.
+        """
+        fetch = fetch or results.fetch_rows
+        with conn.cursor() as cur:
+            stamps = table_stamps(cur, notebook.referenced_tables(sql))
+            if stamps is None:
+                with self._lock:
+                    self.stats["uncacheable"] += 1
+                result = fetch(cur, sql)
+            else:
+                key = self.key(sql, stamps, database_identity(cur))
+                result = self.get(key)
+                if result is None:
+                    result = fetch(cur, sql)
+                    if result is not None:
+                        self.put(key, result)
+        conn.rollback()
+        return result
+
+    def clear(self):
+        with self._lock:
+            for path in self._entries:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
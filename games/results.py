@@ -0,0 +1,215 @@
+"""Streaming, columnar query results for the ``%%nose`` validation cells.
+
+Each call to ``ResultSet.DataFrame()`` in ipython-sql builds a new pandas
+DataFrame from the full list of fetched rows, with one ``Decimal`` per
+numeric cell. ``fetch`` instead reads the query through a server-side
+named cursor, ``batch_size`` rows at a time. It turns each batch into typed
+NumPy arrays straight away, so only the compact columns outlive the batch:
+
+* ``numeric``, ``real`` and ``double precision`` become ``float64``;
+* integers become ``int64``, or ``float64`` with NaN if there are NULLs;
+* ``boolean`` becomes ``bool``;
+* anything else stays an ``object`` array.
+
+Results of at most ``exact_rows`` rows are the exception: their
+``numeric`` columns hold exact ``Decimal`` values, as ipython-sql's do.
+The ``%%nose`` cells compare those with ``D('9.32')``, and
+``9.32 == Decimal('9.32')`` is False. ``numeric`` values arrive as text,
+so the small results parse them to ``Decimal`` and the large ones let NumPy
+parse them to ``float64``.
+
+``stream_rows`` has the ``fetch(cur, sql)`` signature that ``runner``,
+``result_cache`` and ``profiling`` take. It streams SELECTs through
+``fetch`` and runs anything else through ``fetch_rows``. All three take a
+``timings`` dict, into which they add the seconds spent in each phase
+(``execute``, ``fetch``, ``convert``), so ``profiling`` can time the
+path the runner actually uses.
+
+Usage::
+
+    from games import results
+
+    result = results.fetch(conn, "SELECT ... LIMIT 10")
+    df = result.DataFrame()      # built once, then memoized
+    assert df.loc[0, "avg_critic_score"] == D("9.32")
+"""
+
+import decimal
+import itertools
+import re
+import time
+
+import numpy as np
+import pandas as pd
+import psycopg2.extensions
+
+# pg_type OIDs, as reported in cursor.description[i].type_code.
+FLOAT_TYPES = {700, 701, 1700}  # real, double precision, numeric
+INT_TYPES = {20, 21, 23}  # bigint, smallint, integer
+BOOL_TYPES = {16}
+
+NUMERIC_TYPE = 1700
+
+# Leaves numeric values as text, for _to_array to parse exactly or as floats.
+NUMERIC_AS_TEXT = psycopg2.extensions.new_type(
+    (NUMERIC_TYPE,), "NUMERIC_AS_TEXT", lambda value, cur: value
+)
+
+# Results up to this many rows keep numeric columns as Decimal.
+EXACT_ROWS = 1000
+
+_SELECT = re.compile(r"^\s*(?:--[^\n]*\n\s*)*(SELECT|WITH)\b", re.I)
+
+_cursor_names = itertools.count()
+
+
+class _Phase:
+    """Adds the seconds spent in a ``with`` block to ``timings[name]``."""
+
+    def __init__(self, timings, name):
+        self.timings, self.name = timings, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        if self.timings is not None:
+            elapsed = time.perf_counter() - self.start
+            self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+def _to_array(values, type_code, exact=False):
+    if type_code == NUMERIC_TYPE:
+        if exact:
+            return _to_array(
+                [None if value is None else decimal.Decimal(value) for value in values],
+                None,
+            )
+        return np.array(
+            ["nan" if value is None else value for value in values], dtype=np.float64
+        )
+    if type_code in FLOAT_TYPES:
+        return np.array(values, dtype=np.float64)
+    if type_code in INT_TYPES:
+        try:
+            return np.array(values, dtype=np.int64)
+        except TypeError:
+            # NULLs: fall back to float64 with NaN, as pandas does.
+            return np.array(values, dtype=np.float64)
+    if type_code in BOOL_TYPES and None not in values:
+        return np.array(values, dtype=bool)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+class Result:
+    """Columns of a fetched query: ``keys`` in order, ``columns`` as NumPy arrays."""
+
+    def __init__(self, keys, columns):
+        self.keys = keys
+        self.columns = columns
+        self._dataframe = None
+
+    def __len__(self):
+        return len(self.columns[self.keys[0]]) if self.keys else 0
+
+    def DataFrame(self):
+        """Return the result as a DataFrame, built on first call and then reused.
+
+        Callers share the same object, so they must not modify it in place.
+        """
+        if self._dataframe is None:
+            self._dataframe = pd.DataFrame(
+                {key: self.columns[key] for key in self.keys}, copy=False
+            )
+        return self._dataframe
+
+    def __repr__(self):
+        return "Result({} rows, keys={!r})".format(len(self), self.keys)
+
+
+def from_rows(keys, rows):
+    """Build a ``Result`` from already-fetched rows, keeping values as the driver gave them.
+
+    Integer columns become ``int64``. Everything else, including
+    ``Decimal``, stays as an ``object`` array, the same as ipython-sql's
+    ``ResultSet.DataFrame()``.
+    """
+    columns = {}
+    for i, key in enumerate(keys):
+        values = [row[i] for row in rows]
+        if values and all(type(value) is int for value in values):
+            columns[key] = np.array(values, dtype=np.int64)
+        else:
+            columns[key] = _to_array(values, None)
+    return Result(list(keys), columns)
+
+
+def fetch_rows(cur, sql, timings=None):
+    """Run ``sql`` on a plain cursor and return ``from_rows`` of its rows, or ``None``."""
+    with _Phase(timings, "execute"):
+        cur.execute(sql)
+    if cur.description is None:
+        return None
+    with _Phase(timings, "fetch"):
+        rows = cur.fetchall()
+    with _Phase(timings, "convert"):
+        return from_rows([column.name for column in cur.description], rows)
+
+
+def fetch(
+    conn, query, params=None, batch_size=10000, exact_rows=EXACT_ROWS, timings=None
+):
+    """Run ``query`` through a server-side cursor and return a columnar ``Result``.
+
+    ``numeric`` columns are ``Decimal`` if the result has at most
+    ``exact_rows`` rows and ``float64`` otherwise.
+    """
+    name = "games_results_{}".format(next(_cursor_names))
+    with conn.cursor(name=name) as cur:
+        psycopg2.extensions.register_type(NUMERIC_AS_TEXT, cur)
+        cur.itersize = batch_size
+        with _Phase(timings, "execute"):
+            cur.execute(query, params)
+        # One row past exact_rows tells a small result from a large one.
+        with _Phase(timings, "fetch"):
+            rows = cur.fetchmany(exact_rows + 1)
+        keys = [column.name for column in cur.description]
+        type_codes = [column.type_code for column in cur.description]
+        exact = len(rows) <= exact_rows
+        batches = []
+        while rows:
+            with _Phase(timings, "convert"):
+                batches.append(
+                    [
+                        _to_array([row[i] for row in rows], type_code, exact)
+                        for i, type_code in enumerate(type_codes)
+                    ]
+                )
+            with _Phase(timings, "fetch"):
+                rows = cur.fetchmany(batch_size)
+    with _Phase(timings, "convert"):
+        return _concatenate(keys, type_codes, batches)
+
+
+def _concatenate(keys, type_codes, batches):
+    if batches:
+        columns = {
+            key: np.concatenate([batch[i] for batch in batches])
+            for i, key in enumerate(keys)
+        }
+    else:
+        columns = {
+            key: _to_array([], type_code, True)
+            for key, type_code in zip(keys, type_codes)
+        }
+    return Result(keys, columns)
+
+
+def stream_rows(cur, sql, timings=None):
+    """``fetch`` for a SELECT on ``cur``'s connection, ``fetch_rows`` for anything else."""
+    if not _SELECT.match(sql):
+        return fetch_rows(cur, sql, timings)
+    return fetch(cur.connection, sql, timings=timings)
@@ -0,0 +1,253 @@
+"""Headless runner for the notebook's ``%%sql`` and ``%%nose`` cells.
+
+In the notebook the cells run one after another, and each ``%%sql`` cell
+opens its own session. ``run_notebook`` reads the SQL bodies out of
+``notebook (4).py`` and uses a bounded pool of reusable connections to
+run the independent reads concurrently. In[26] and In[30] read the
+``top_*`` tables, so they wait until ``derived`` has refreshed those
+tables. Then each ``%%nose`` cell runs against the result of the cell it
+checks. The whole case study takes about as long as its slowest query.
+
+Results are read with ``results.stream_rows``, so small results keep
+their ``numeric`` values as ``Decimal`` and the ``D('9.32')`` assertions
+hold.
+
+``test_output_type`` checks that the output is an ipython-sql ``ResultSet``.
+The runner produces ``results.Result`` objects instead, so that test is
+reported as skipped. Every other test runs unchanged.
+
+Usage::
+
+    python -m games.runner --workers 4
+"""
+
+import argparse
+import concurrent.futures
+import functools
+import sys
+import time
+import traceback
+
+import psycopg2.pool
+
+from . import derived, notebook, profiling, result_cache, results
+
+SKIPPED_TESTS = {
+    "test_output_type": "checks for ipython-sql's ResultSet; the runner returns results.Result",
+}
+
+
+class CellRun:
+    """The outcome of one ``%%sql`` cell and the ``%%nose`` tests paired with it."""
+
+    def __init__(self, cell, sql, tables):
+        self.cell = cell
+        self.sql = sql
+        self.tables = tables
+        self.seconds = None
+        self.result = None
+        self.error = None
+        self.tests = []  # (name, "passed" | "failed" | "error" | "skipped", message)
+
+    @property
+    def ok(self):
+        return self.error is None and all(
+            outcome in ("passed", "skipped") for _, outcome, _ in self.tests
+        )
+
+    def __repr__(self):
+        return "CellRun({!r}, seconds={!r}, ok={!r})".format(
+            self.cell.label, self.seconds, self.ok
+        )
+
+
+def _execute(pool, sql, cache=None, fetch=None):
+    fetch = fetch or results.stream_rows
+    conn = pool.getconn()
+    try:
+        if cache is not None:
+            return cache.execute(conn, sql, fetch)
+        with conn.cursor() as cur:
+            result = fetch(cur, sql)
+        conn.rollback()
+        return result
+    finally:
+        pool.putconn(conn)
+
+
+def _refresh(pool, tables, names):
+    conn = pool.getconn()
+    try:
+        return tables.refresh(conn, names)
+    finally:
+        pool.putconn(conn)
+
+
+def _run_cell(pool, run, refreshing, cache, profiler):
+    if refreshing is not None:
+        # Re-raises a failed refresh, so the dependent cell reports it.
+        refreshing.result()
+    fetch = None
+    if profiler is not None:
+        fetch = functools.partial(profiler.fetch, label=run.cell.label)
+    start = time.perf_counter()
+    try:
+        run.result = _execute(pool, run.sql, cache, fetch)
+    finally:
+        run.seconds = time.perf_counter() - start
+    return run
+
+
+def run_tests(nose_cell, result):
+    """Run the ``test_*`` functions of ``nose_cell`` with ``_`` bound to ``result``."""
+    namespace = {"_": result, "__name__": "nose_{}".format(nose_cell.label)}
+    try:
+        exec(compile(nose_cell.body, nose_cell.label, "exec"), namespace)
+    except Exception:
+        return [("<cell>", "error", traceback.format_exc(limit=1).strip())]
+    outcomes = []
+    for name, test in namespace.items():
+        if not name.startswith("test_") or not callable(test):
+            continue
+        if name in SKIPPED_TESTS:
+            outcomes.append((name, "skipped", SKIPPED_TESTS[name]))
+            continue
+        try:
+            test()
+        except AssertionError as e:
+            outcomes.append((name, "failed", str(e)))
+        except Exception as e:
+            outcomes.append((name, "error", "{}: {}".format(type(e).__name__, e)))
+        else:
+            outcomes.append((name, "passed", ""))
+    return outcomes
+
+
+def run_notebook(
+    dsn=None,
+    path=notebook.NOTEBOOK,
+    workers=4,
+    derived_tables=None,
+    cache=None,
+    profiler=None,
+):
+    """Run every ``%%sql`` cell and its tests, returning ``CellRun`` objects in notebook order.
+
+    ``dsn`` defaults to the connection string on the notebook's first
+    ``%%sql`` cell. Pass a ``result_cache.ResultCache`` as ``cache`` to
+    answer unchanged cells from disk, and a ``profiling.Profiler`` as
+    ``profiler`` to record timings and plans for every cell that runs.
+    """
+    cells = notebook.read_cells(path)
+    if derived_tables is None:
+        derived_tables = derived.case_study_tables()
+
+    runs = []
+    for cell in cells:
+        if cell.magic != "sql":
+            continue
+        connection, sql = notebook.split_connection(cell.body)
+        dsn = dsn or connection
+        runs.append(CellRun(cell, sql, notebook.referenced_tables(sql)))
+    if dsn is None:
+        raise ValueError("No connection string given or found in the notebook")
+
+    needed = sorted(
+        {
+            table
+            for run in runs
+            for table in run.tables
+            if table in derived_tables.tables
+        }
+    )
+    pool = psycopg2.pool.ThreadedConnectionPool(1, workers, dsn)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # Submitted first, so cells waiting on it can never starve it of a worker.
+            refreshing = (
+                executor.submit(_refresh, pool, derived_tables, needed)
+                if needed
+                else None
+            )
+            futures = {}
+            for run in runs:
+                depends = refreshing if set(run.tables) & set(needed) else None
+                futures[
+                    executor.submit(_run_cell, pool, run, depends, cache, profiler)
+                ] = run
+            for future in concurrent.futures.as_completed(futures):
+                if future.exception() is not None:
+                    futures[future].error = future.exception()
+    finally:
+        pool.closeall()
+
+    by_label = {run.cell.label: run for run in runs}
+    for sql_cell, nose_cell in notebook.pair_tests(cells):
+        run = by_label[sql_cell.label]
+        if run.error is None:
+            run.tests = run_tests(nose_cell, run.result)
+    return runs
+
+
+def print_report(runs, wall_seconds):
+    for run in runs:
+        if run.error is not None:
+            print("{:<8} ERROR  {}".format(run.cell.label, run.error))
+            continue
+        counts = {}
+        for _, outcome, _ in run.tests:
+            counts[outcome] = counts.get(outcome, 0) + 1
+        print(
+            "{:<8} {:>8.3f}s {:>6} rows  {}".format(
+                run.cell.label,
+                run.seconds,
+                len(run.result) if run.result is not None else 0,
+                ", ".join(
+                    "{} {}".format(n, outcome) for outcome, n in sorted(counts.items())
+                )
+                or "no tests",
+            )
+        )
+        for name, outcome, message in run.tests:
+            if outcome in ("failed", "error"):
+                print("    {} {}: {}".format(name, outcome, message))
+    print("total    {:>8.3f}s wall".format(wall_seconds))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dsn", help="defaults to the notebook's connection string")
+    parser.add_argument("--notebook", default=notebook.NOTEBOOK)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--cache", action="store_true", help="answer unchanged cells from disk"
+    )
+    parser.add_argument(
+        "--trace", help="profile every cell and write a Chrome trace to this path"
+    )
+    args = parser.parse_args(argv)
+
+    cache = result_cache.ResultCache() if args.cache else None
+    profiler = profiling.Profiler() if args.trace else None
+    start = time.perf_counter()
+    runs = run_notebook(
+        args.dsn, args.notebook, args.workers, cache=cache, profiler=profiler
+    )
+    print_report(runs, time.perf_counter() - start)
+    if profiler is not None:
+        profiling.print_profile(profiler.records)
+        profiler.write_chrome_trace(args.trace)
+    if cache is not None:
+        print(
+            "cache    {} hits, {} misses, {} evictions, {:.1f} KiB".format(
+                cache.stats["hits"],
+                cache.stats["misses"],
+                cache.stats["evictions"],
+                cache.size_bytes / 1024.0,
+            )
+        )
+    return 0 if all(run.ok for run in runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
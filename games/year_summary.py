@@ -0,0 +1,284 @@
+"""Incrementally maintained per-year aggregates of ``game_sales ⋈ reviews``.
+
+Every analysis cell in the notebook joins ``game_sales`` to ``reviews`` on
+``game_id`` (see ``game_keys``) and groups by ``year``. The ``year_summary`` table holds the
+counts and sums those cells need, one row per year, and is kept current
+by statement-level triggers on both base tables. The avg-critic, avg-user,
+HAVING-count and total-sold queries then read a few dozen rows instead of
+re-running the join.
+
+Each trigger works out which join rows its statement added and removed,
+aggregates them by year and adds the difference onto ``year_summary``.
+A review inserted or deleted for a game changes every sales row of that
+game, including whether the row counts as unreviewed, so the reviews
+triggers re-aggregate the affected games before and after the change.
+
+Rows with a NULL ``year`` are kept under the ``NULL_YEAR`` sentinel,
+because the primary key cannot be NULL; ``QUERIES`` map it back to NULL
+so the NULL-year group still shows up as it does in the original cells.
+
+Every trigger, and ``REBUILD``, starts by taking ``year_summary`` in SHARE
+ROW EXCLUSIVE mode, which conflicts with itself. Under READ COMMITTED a
+sales insert and a reviews insert for the same game in two concurrent
+transactions would otherwise each miss the other's uncommitted rows. With
+the lock, the second trigger waits for the first transaction to finish
+and its next statement sees the committed rows.
+
+Usage::
+
+    import psycopg2
+    from games import year_summary
+
+    conn = psycopg2.connect("dbname=games")
+    year_summary.install(conn)
+    with conn.cursor() as cur:
+        cur.execute(year_summary.QUERIES["In[24]"])
+"""
+
+TABLE = "year_summary"
+
+# Stands in for a NULL game_sales.year in the year_summary primary key.
+NULL_YEAR = -1
+
+_LOCK = "LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE;".format(TABLE)
+
+# (column, type, aggregate over one join row set aliased g LEFT JOIN r)
+COLUMNS = [
+    # COUNT(g.game) of the INNER JOIN, as in the HAVING clauses.
+    ("num_games", "bigint", "COUNT(r.game_id)"),
+    # game_sales rows with no review at all.
+    ("num_unreviewed", "bigint", "COUNT(*) FILTER (WHERE r.game_id IS NULL)"),
+    # Reviewed rows where both scores are NULL.
+    (
+        "num_unscored",
+        "bigint",
+        "COUNT(*) FILTER (WHERE r.game_id IS NOT NULL"
+        " AND r.critic_score IS NULL AND r.user_score IS NULL)",
+    ),
+    ("critic_sum", "numeric", "COALESCE(SUM(r.critic_score), 0)"),
+    ("critic_count", "bigint", "COUNT(r.critic_score)"),
+    ("user_sum", "numeric", "COALESCE(SUM(r.user_score), 0)"),
+    ("user_count", "bigint", "COUNT(r.user_score)"),
+    (
+        "games_sold_sum",
+        "numeric",
+        "COALESCE(SUM(g.games_sold) FILTER (WHERE r.game_id IS NOT NULL), 0)",
+    ),
+    (
+        "games_sold_count",
+        "bigint",
+        "COUNT(g.games_sold) FILTER (WHERE r.game_id IS NOT NULL)",
+    ),
+]
+
+COLUMN_NAMES = [name for name, _, _ in COLUMNS]
+
+
+def _contribution(sales, reviews, sign=1, where=""):
+    """SELECT the per-year aggregates of ``sales LEFT JOIN reviews``, times ``sign``."""
+    prefix = "" if sign == 1 else "{} * ".format(sign)
+    aggregates = ",\n       ".join(
+        "{}{} AS {}".format(prefix, expr, name) for name, _, expr in COLUMNS
+    )
+    return (
+        "SELECT COALESCE(g.year, {}) AS year,\n       {}\n"
+        "FROM {} AS g\n"
+        "LEFT JOIN {} AS r\n"
+        "ON g.game_id = r.game_id\n"
+        "{}"
+        "GROUP BY 1".format(NULL_YEAR, aggregates, sales, reviews, where)
+    )
+
+
+def _apply(parts, with_clause=""):
+    """Add the summed ``parts`` onto ``year_summary``, creating missing years."""
+    names = ", ".join(COLUMN_NAMES)
+    sums = ", ".join("SUM({0}) AS {0}".format(name) for name in COLUMN_NAMES)
+    updates = ",\n    ".join(
+        "{0} = {1}.{0} + EXCLUDED.{0}".format(name, TABLE) for name in COLUMN_NAMES
+    )
+    return (
+        "{}INSERT INTO {} (year, {})\n"
+        "SELECT year, {}\n"
+        "FROM (\n{}\n) AS delta\n"
+        "GROUP BY year\n"
+        "ON CONFLICT (year) DO UPDATE SET\n    {};".format(
+            with_clause,
+            TABLE,
+            names,
+            sums,
+            "\nUNION ALL\n".join(parts),
+            updates,
+        )
+    )
+
+
+_PRUNE = "DELETE FROM {} WHERE num_games = 0 AND num_unreviewed = 0;".format(TABLE)
+
+
+def _sales_delta(tg_op):
+    """Statement applying a ``game_sales`` change; ``reviews`` is unchanged."""
+    parts = []
+    if tg_op in ("INSERT", "UPDATE"):
+        parts.append(_contribution("new_rows", "reviews", 1))
+    if tg_op in ("DELETE", "UPDATE"):
+        parts.append(_contribution("old_rows", "reviews", -1))
+    return _apply(parts)
+
+
+def _reviews_delta(tg_op):
+    """Statement applying a ``reviews`` change to every sales row of the affected games.
+
+    ``reviews`` already holds the new state inside an AFTER trigger, so the
+    old state of the affected games is rebuilt from the transition tables.
+    """
+    review_cols = "game_id, critic_score, user_score"
+    current = (
+        "SELECT {} FROM reviews WHERE game_id IN (SELECT game_id FROM affected)".format(
+            review_cols
+        )
+    )
+    if tg_op == "INSERT":
+        affected = "SELECT game_id FROM new_rows"
+        before = "{} EXCEPT ALL SELECT {} FROM new_rows".format(current, review_cols)
+    elif tg_op == "DELETE":
+        affected = "SELECT game_id FROM old_rows"
+        before = "{} UNION ALL SELECT {} FROM old_rows".format(current, review_cols)
+    else:
+        affected = "SELECT game_id FROM new_rows UNION SELECT game_id FROM old_rows"
+        before = "({} EXCEPT ALL SELECT {} FROM new_rows) UNION ALL SELECT {} FROM old_rows".format(
+            current, review_cols, review_cols
+        )
+    with_clause = (
+        "WITH affected AS ({}),\n"
+        "     reviews_before AS ({}),\n"
+        "     reviews_after AS ({})\n".format(affected, before, current)
+    )
+    where = "WHERE g.game_id IN (SELECT game_id FROM affected)\n"
+    return _apply(
+        [
+            _contribution("game_sales", "reviews_after", 1, where),
+            _contribution("game_sales", "reviews_before", -1, where),
+        ],
+        with_clause,
+    )
+
+
+def _trigger_function(name, delta):
+    branches = "\n".join(
+        "    {}IF TG_OP = '{}' THEN\n{}".format(
+            "ELS" if i else "", tg_op, delta(tg_op)
+        )
+        for i, tg_op in enumerate(("INSERT", "DELETE", "UPDATE"))
+    )
+    return (
+        "CREATE OR REPLACE FUNCTION {}() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+        "BEGIN\n    {}\n{}\n    END IF;\n    {}\n    RETURN NULL;\nEND\n$$;".format(
+            name, _LOCK, branches, _PRUNE
+        )
+    )
+
+
+REBUILD = "{}\nDELETE FROM {};\n{}".format(
+    _LOCK, TABLE, _apply([_contribution("game_sales", "reviews", 1)])
+)
+
+
+def _ddl():
+    columns = ",\n    ".join(
+        "{} {} NOT NULL DEFAULT 0".format(name, type_) for name, type_, _ in COLUMNS
+    )
+    statements = [
+        "CREATE TABLE IF NOT EXISTS {} (\n    year int PRIMARY KEY,\n    {}\n);".format(
+            TABLE, columns
+        ),
+        _trigger_function("year_summary_sales_delta", _sales_delta),
+        _trigger_function("year_summary_reviews_delta", _reviews_delta),
+        "CREATE OR REPLACE FUNCTION year_summary_rebuild() RETURNS trigger "
+        "LANGUAGE plpgsql AS $$\nBEGIN\n{}\nRETURN NULL;\nEND\n$$;".format(REBUILD),
+    ]
+    for table, function in (
+        ("game_sales", "year_summary_sales_delta"),
+        ("reviews", "year_summary_reviews_delta"),
+    ):
+        # Transition tables allow only one event per trigger.
+        for event, referencing in (
+            ("INSERT", "NEW TABLE AS new_rows"),
+            ("DELETE", "OLD TABLE AS old_rows"),
+            ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+        ):
+            trigger = "{}_{}_{}".format(TABLE, table, event.lower())
+            statements.append(
+                "DROP TRIGGER IF EXISTS {0} ON {1};\n"
+                "CREATE TRIGGER {0} AFTER {2} ON {1}\n"
+                "REFERENCING {3}\n"
+                "FOR EACH STATEMENT EXECUTE FUNCTION {4}();".format(
+                    trigger, table, event, referencing, function
+                )
+            )
+        trigger = "{}_{}_truncate".format(TABLE, table)
+        statements.append(
+            "DROP TRIGGER IF EXISTS {0} ON {1};\n"
+            "CREATE TRIGGER {0} AFTER TRUNCATE ON {1}\n"
+            "FOR EACH STATEMENT EXECUTE FUNCTION year_summary_rebuild();".format(
+                trigger, table
+            )
+        )
+    return "\n\n".join(statements)
+
+
+DDL = _ddl()
+
+
+def install(conn):
+    """Create ``year_summary`` and its triggers, then fill it from the base tables."""
+    with conn.cursor() as cur:
+        cur.execute(DDL)
+        cur.execute(REBUILD)
+    conn.commit()
+
+
+def rebuild(conn):
+    """Recompute ``year_summary`` from scratch, e.g. after loading with triggers disabled."""
+    with conn.cursor() as cur:
+        cur.execute(REBUILD)
+    conn.commit()
+
+
+# The notebook's aggregate cells rewritten as lookups against year_summary.
+# Each returns the same columns, in the same order, as the original cell,
+# with NULL_YEAR (-1) turned back into NULL.
+QUERIES = {
+    "In[20]": """
+SELECT COALESCE(SUM(num_unreviewed + num_unscored), 0)::bigint AS count
+FROM year_summary;""",
+    "In[22]": """
+SELECT NULLIF(year, -1) AS year,
+       ROUND(critic_sum / NULLIF(critic_count, 0), 2) AS avg_critic_score
+FROM year_summary
+ORDER BY avg_critic_score DESC
+LIMIT 10;""",
+    "In[24]": """
+SELECT NULLIF(year, -1) AS year,
+       ROUND(critic_sum / num_games, 2) AS avg_critic_score, -- NULL reviews as 0
+       num_games
+FROM year_summary
+WHERE num_games > 4
+ORDER BY avg_critic_score DESC
+LIMIT 10;""",
+    "In[28]": """
+SELECT NULLIF(year, -1) AS year,
+       num_games,
+       ROUND(user_sum / NULLIF(user_count, 0), 2) AS avg_user_score
+FROM year_summary
+WHERE num_games > 4
+ORDER BY avg_user_score DESC
+LIMIT 10;""",
+    "In[32]": """
+SELECT year,
+       CASE WHEN games_sold_count > 0 THEN games_sold_sum END AS total_games_sold
+FROM year_summary
+WHERE year IN (1998, 2002, 2008)
+  AND num_games > 0
+ORDER BY total_games_sold DESC;""",
+}
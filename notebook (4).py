@@ -81,7 +81,7 @@
 # In[19]:
 
 
-get_ipython().run_cell_magic('sql', '', 'postgresql:///games\n\n-- We want to see the top 10 best selling video games of all time\nSELECT *\nFROM game_sales\nORDER BY games_sold DESC\nLIMIT 10;')
+get_ipython().run_cell_magic('sql', '', 'postgresql:///games\n\n-- We want to see the top 10 best selling video games of all time\n-- We list the columns so the game_id key from games/game_keys.py stays out of the output.\nSELECT game, platform, publisher, developer, games_sold, year\nFROM game_sales\nORDER BY games_sold DESC\nLIMIT 10;')
 
 
 # # 2. Missing review scores
@@ -91,7 +91,7 @@ get_ipython().run_cell_magic('sql', '', 'postgresql:///games\n\n-- We want to se
 # In[20]:
 
 
-get_ipython().run_cell_magic('sql', '', '\n-- Since we are going to use reviews as a metric to judge the quality of games that year,\n-- We want to check the limitations of our database in terms of NULL review values.\n-- We check how many of the games that were included in both tables had NULL reviews.\nSELECT COUNT(*)\nFROM game_sales AS g\nLEFT JOIN reviews AS r\nON g.game = r.game\nWHERE r.critic_score IS NULL AND r.user_score IS NULL;')
+get_ipython().run_cell_magic('sql', '', '\n-- Since we are going to use reviews as a metric to judge the quality of games that year,\n-- We want to check the limitations of our database in terms of NULL review values.\n-- We check how many of the games that were included in both tables had NULL reviews.\n-- We join on the integer game_id key from games/game_keys.py, which matches titles after normalizing them.\nSELECT COUNT(*)\nFROM game_sales AS g\nLEFT JOIN reviews AS r\nON g.game_id = r.game_id\nWHERE r.critic_score IS NULL AND r.user_score IS NULL;')
 
 
 # In[21]:
@@ -107,7 +107,7 @@ get_ipython().run_cell_magic('nose', '', 'last_output = _\n\ndef test_output_typ
 # In[22]:
 
 
-get_ipython().run_cell_magic('sql', '', '\n-- We want to check the average critic score of each year\n-- And see the top scoring years\n-- To do this, we group by year and aggregate the years by AVG of its critic scores.\nSELECT g.year,\n       ROUND(AVG(r.critic_score),2) AS avg_critic_score\nFROM game_sales AS g\nLEFT JOIN reviews AS r\nON g.game = r.game\nGROUP BY g.year\nORDER BY avg_critic_score DESC\nLIMIT 10;')
+get_ipython().run_cell_magic('sql', '', '\n-- We want to check the average critic score of each year\n-- And see the top scoring years\n-- To do this, we group by year and aggregate the years by AVG of its critic scores.\nSELECT g.year,\n       ROUND(AVG(r.critic_score),2) AS avg_critic_score\nFROM game_sales AS g\nLEFT JOIN reviews AS r\nON g.game_id = r.game_id\nGROUP BY g.year\nORDER BY avg_critic_score DESC\nLIMIT 10;')
 
 
 # In[23]:
@@ -124,7 +124,7 @@ get_ipython().run_cell_magic('nose', '', 'from decimal import Decimal as D\nlast
 # In[24]:
 
 
-get_ipython().run_cell_magic('sql', '', '\n-- Here, we filter out years that had less than 5 reviewed games in our database.\n-- We do this with the HAVING clause : A filtering that lets use the aggregated filter COUNT()\n-- We also use INNER JOIN on the game_sales and reviews table to filter out games not in both tables.\nSELECT g.year,\n       ROUND(AVG(COALESCE(r.critic_score, 0)), 2) AS avg_critic_score, -- NULL reviews as 0 \n       COUNT(g.game) AS num_games\nFROM game_sales AS g\nINNER JOIN reviews AS r\nON g.game = r.game\nGROUP BY g.year\nHAVING COUNT(g.game) > 4\nORDER BY avg_critic_score DESC\nLIMIT 10;')
+get_ipython().run_cell_magic('sql', '', '\n-- Here, we filter out years that had less than 5 reviewed games in our database.\n-- We do this with the HAVING clause : A filtering that lets use the aggregated filter COUNT()\n-- We also use INNER JOIN on the game_sales and reviews table to filter out games not in both tables.\nSELECT g.year,\n       ROUND(AVG(COALESCE(r.critic_score, 0)), 2) AS avg_critic_score, -- NULL reviews as 0 \n       COUNT(g.game) AS num_games\nFROM game_sales AS g\nINNER JOIN reviews AS r\nON g.game_id = r.game_id\nGROUP BY g.year\nHAVING COUNT(g.game) > 4\nORDER BY avg_critic_score DESC\nLIMIT 10;')
 
 
 # In[25]:
@@ -205,7 +205,7 @@ get_ipython().run_cell_magic('nose', '', 'last_output = _\n\ndef test_output_typ
 # In[28]:
 
 
-get_ipython().run_cell_magic('sql', '', '\n-- We want to know the years that the general public loved, based on their ratings.\n-- We do this by grouping by year, filtering for years that had 5 or more reviewed games\n-- We also order by avg rating to find the top 10 scoring years.\nSELECT g.year,\n       COUNT(g.game) AS num_games,\n       ROUND(AVG(r.user_score),2) AS avg_user_score\nFROM game_sales AS g\nINNER JOIN reviews AS r\nON g.game = r.game\nGROUP BY g.year\nHAVING COUNT(g.game) > 4\nORDER BY avg_user_score DESC\nLIMIT 10;')
+get_ipython().run_cell_magic('sql', '', '\n-- We want to know the years that the general public loved, based on their ratings.\n-- We do this by grouping by year, filtering for years that had 5 or more reviewed games\n-- We also order by avg rating to find the top 10 scoring years.\nSELECT g.year,\n       COUNT(g.game) AS num_games,\n       ROUND(AVG(r.user_score),2) AS avg_user_score\nFROM game_sales AS g\nINNER JOIN reviews AS r\nON g.game_id = r.game_id\nGROUP BY g.year\nHAVING COUNT(g.game) > 4\nORDER BY avg_user_score DESC\nLIMIT 10;')
 
 
 # In[29]:
@@ -292,7 +292,7 @@ get_ipython().run_cell_magic('nose', '', 'last_output = _\n\ndef test_output_typ
 # In[32]:
 
 
-get_ipython().run_cell_magic('sql', '', '\n-- What also matters in how good a game was is the number of times the game was sold\n-- We can find this in our games_sales table under the games_sold column\n-- To find total games sold, we can GROUP BY year then SUM up every game in the grouped year.\n-- We know that the top 10 year, based on critic and general public reviews were 1998 , 2002, 2008\n-- Thus, we can use a WHERE year IN to check if those years were also a top 10 video game selling year.\n-- Our query returns all three years, thus 2008,  2002, and 1998 are the top years for video games, according to our SQL queries.\nSELECT g.year,\n       SUM(g.games_sold) AS total_games_sold\nFROM game_sales AS g\nINNER JOIN reviews AS r\nON g.game = r.game\nWHERE g.year IN (1998 , 2002 , 2008)\nGROUP BY g.year\nORDER BY total_games_sold DESC')
+get_ipython().run_cell_magic('sql', '', '\n-- What also matters in how good a game was is the number of times the game was sold\n-- We can find this in our games_sales table under the games_sold column\n-- To find total games sold, we can GROUP BY year then SUM up every game in the grouped year.\n-- We know that the top 10 year, based on critic and general public reviews were 1998 , 2002, 2008\n-- Thus, we can use a WHERE year IN to check if those years were also a top 10 video game selling year.\n-- Our query returns all three years, thus 2008,  2002, and 1998 are the top years for video games, according to our SQL queries.\nSELECT g.year,\n       SUM(g.games_sold) AS total_games_sold\nFROM game_sales AS g\nINNER JOIN reviews AS r\nON g.game_id = r.game_id\nWHERE g.year IN (1998 , 2002 , 2008)\nGROUP BY g.year\nORDER BY total_games_sold DESC')
 
 
 # In[33]:
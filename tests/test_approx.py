@@ -0,0 +1,82 @@
+from decimal import Decimal as D
+
+from games import approx
+
+
+def row(year, weight=10.0, sampled=100, joined=100, n=100, mean=8.0, sd=1.0, **kw):
+    values = {
+        "year": year,
+        "weight": weight,
+        "sampled": sampled,
+        "join_rows": max(sampled, joined),
+        "joined": joined,
+        "matched": min(sampled, joined),
+        "n": n,
+        "mean": mean,
+        "sd": sd,
+        "rounded": None if mean is None else D(str(round(mean, 2))),
+        "sold_mean": 1.0,
+        "sold_sd": 0.5,
+        "sold_sum": D("100.00"),
+    }
+    values.update(kw)
+    return values
+
+
+def estimate(year, mean=8.0, **kw):
+    return approx._estimate(row(year, mean=mean, **kw), approx.Z_99, "score")
+
+
+def test_estimate_fully_sampled_year_is_exact():
+    e = estimate(1998, mean=7.625, weight=1.0, rounded=D("7.63"))
+    assert e.exact
+    assert (e.value, e.low, e.high) == (7.63, 7.63, 7.63)
+    assert e.count == e.count_low == e.count_high == 100
+
+
+def test_estimate_sampled_year_has_interval():
+    e = estimate(2002)
+    assert not e.exact
+    assert e.low < 8.0 < e.high
+    assert e.count == 1000
+
+
+def test_estimate_counts_duplicate_reviews_as_join_rows():
+    e = estimate(2002, sampled=10, joined=12, matched=6, n=12)
+    assert e.count == 120
+    assert e.count_low < 120 < e.count_high
+
+    exact = estimate(2002, weight=1.0, sampled=10, joined=12, matched=6, n=12)
+    assert exact.count == exact.count_low == exact.count_high == 12
+
+
+def test_estimate_sales_sums_population():
+    e = approx._estimate(row(2002, weight=1.0), approx.Z_99, "sales")
+    assert e.exact and e.value == 100.0
+
+
+def test_ambiguous_overlapping_top_boundary():
+    estimates = [estimate(2000, mean=9.0), estimate(2001, mean=8.0)]
+    estimates.append(estimate(2002, mean=7.95))
+    assert approx._ambiguous(estimates, None, 1) == set()
+    assert approx._ambiguous(estimates, None, 2) == {2001, 2002}
+
+
+def test_ambiguous_threshold_straddle():
+    thin = estimate(2000, weight=10.0, sampled=2, joined=1, n=1)
+    assert thin.count_low <= 4 < thin.count_high
+    assert approx._ambiguous([thin], 4, 10) == {2000}
+
+
+def test_ambiguous_sampled_year_without_value():
+    unscored = estimate(2003, mean=None, sd=None, n=0)
+    assert approx._ambiguous([estimate(2000), unscored], None, 10) == {2003}
+
+    exact = estimate(2003, mean=None, sd=None, n=0, weight=1.0)
+    assert approx._ambiguous([estimate(2000), exact], None, 10) == set()
+
+
+def test_ambiguous_without_limit_checks_every_pair():
+    estimates = [estimate(1998, mean=9.0), estimate(2002, mean=8.0)]
+    estimates.append(estimate(2008, mean=7.95))
+    assert approx._ambiguous(estimates, None, None) == {2002, 2008}
@@ -0,0 +1,18 @@
+import csv
+
+from games import bench, columnar
+
+
+def read(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))[1:]
+
+
+def test_generate_emits_unique_game_platform_pairs(tmp_path):
+    for rows in (400, 13000):
+        sales, reviews = bench.generate(str(tmp_path), rows)
+        sales_rows = read(sales)
+        assert len(sales_rows) == rows
+        assert len({(game, platform) for game, platform, *_ in sales_rows}) == rows
+        titles = {columnar.normalize_title(game) for game, *_ in read(reviews)}
+        assert len(titles) == len(read(reviews))
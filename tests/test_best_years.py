@@ -0,0 +1,123 @@
+import psycopg2.errors
+import pytest
+
+from games import best_years
+
+
+class Server:
+    """The prepared statements of one backend, shared by its cursors."""
+
+    def __init__(self):
+        self.prepared = {}
+        self.log = []
+
+
+class Cursor:
+    description = None
+
+    def __init__(self, server):
+        self.server = server
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        server = self.server
+        words = sql.split()
+        server.log.append(words[0])
+        if words[0] == "PREPARE":
+            if words[1] in server.prepared:
+                raise psycopg2.errors.DuplicatePreparedStatement(words[1])
+            server.prepared[words[1]] = sql
+        elif words[0] == "EXECUTE":
+            if words[1] not in server.prepared:
+                raise psycopg2.errors.InvalidSqlStatementName(words[1])
+            self.description = [type("Column", (), {"name": "year"})]
+            self.rows = [(2002,)]
+        elif words[0] == "DEALLOCATE":
+            del server.prepared[words[1]]
+        elif "pg_prepared_statements" in sql:
+            self.rows = [
+                (name,)
+                for name in server.prepared
+                if name == params[0]
+                or ("starts_with" in sql and name.startswith(params[0]))
+            ]
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class Connection:
+    def __init__(self, server):
+        self.server = server
+        self.rollbacks = 0
+
+    def cursor(self):
+        return Cursor(self.server)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_top_years_sql_binds_threshold_limit_and_slice():
+    sql = best_years.top_years_sql("critic", "zero", "inner", "platform")
+    assert "ROUND(AVG(COALESCE(r.critic_score, 0)), 2) AS avg_critic_score" in sql
+    assert "INNER JOIN reviews AS r" in sql
+    assert "WHERE g.platform = $3" in sql
+    assert sql.endswith(
+        "HAVING COUNT(g.game) > $1\nORDER BY avg_critic_score DESC\nLIMIT $2"
+    )
+    assert "$3" not in best_years.top_years_sql("user", "ignore", "left", None)
+
+
+def test_sweep_sql_ranks_each_threshold_and_slice():
+    sql = best_years.sweep_sql("user", "ignore", "inner", "publisher")
+    assert "g.publisher AS publisher," in sql
+    assert "GROUP BY g.year, g.publisher" in sql
+    assert "PARTITION BY t.threshold, p.publisher" in sql
+    assert "ON p.num_games > t.threshold" in sql
+    assert sql.endswith("ORDER BY threshold, publisher, rank")
+
+
+def test_rejects_unknown_choices():
+    with pytest.raises(ValueError):
+        best_years.top_years_sql("critic", "ignore", "outer", None)
+    with pytest.raises(ValueError):
+        best_years.BestYears(None).top_years(platform="PC", publisher="Nintendo")
+
+
+def test_second_instance_reuses_the_connections_statements():
+    server = Server()
+    first = best_years.BestYears(Connection(server))
+    assert first.top_years().keys == ["year"]
+    second = best_years.BestYears(Connection(server))
+    assert second.top_years().keys == ["year"]
+    assert server.log.count("PREPARE") == 1
+
+
+def test_statement_dropped_by_discard_all_is_prepared_again():
+    server = Server()
+    conn = Connection(server)
+    best = best_years.BestYears(conn)
+    best.top_years()
+    server.prepared.clear()  # DISCARD ALL
+    assert best.top_years().keys == ["year"]
+    assert server.log.count("PREPARE") == 2
+    assert conn.rollbacks == 3
+
+
+def test_deallocate_drops_every_best_years_statement():
+    server = Server()
+    best_years.BestYears(Connection(server)).top_years()
+    best_years.BestYears(Connection(server)).sweep()
+    server.prepared["other"] = "PREPARE other AS SELECT 1"
+    best_years.BestYears(Connection(server)).deallocate()
+    assert list(server.prepared) == ["other"]
@@ -0,0 +1,59 @@
+import pytest
+
+from games import bulk_load
+
+
+def write_csv(tmp_path, text):
+    path = tmp_path / "feed.csv"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_chunks_reorders_maps_and_splits(tmp_path):
+    path = write_csv(
+        tmp_path,
+        'Score,Name,User\n9.1,Halo 3,8.0\n8.5,"Zelda, The",9.0\n7.0,Doom,\n',
+    )
+    columns = bulk_load.TABLES["reviews"]["columns"]
+    chunks = list(
+        bulk_load._chunks(
+            path,
+            columns,
+            2,
+            {"game": "Name", "critic_score": "Score", "user_score": "User"},
+        )
+    )
+    assert [rows for _, rows in chunks] == [2, 1]
+    assert chunks[0][0].read() == 'Halo 3,9.1,8.0\r\n"Zelda, The",8.5,9.0\r\n'
+    assert chunks[1][0].read() == "Doom,7.0,\r\n"
+
+
+def test_chunks_reports_missing_columns(tmp_path):
+    path = write_csv(tmp_path, "game,critic_score\nHalo 3,9.1\n")
+    with pytest.raises(ValueError, match="user_score"):
+        list(bulk_load._chunks(path, bulk_load.TABLES["reviews"]["columns"], 10, {}))
+
+
+def test_swap_sql_keeps_last_row_per_key():
+    assert bulk_load._swap_sql("game_sales") == (
+        "INSERT INTO game_sales (game, platform, publisher, developer, games_sold, year)\n"
+        "SELECT DISTINCT ON (s.game, s.platform) s.game, s.platform, s.publisher,"
+        " s.developer, s.games_sold, s.year\n"
+        "FROM game_sales_staging AS s\n"
+        "ORDER BY s.game, s.platform, s.staging_seq DESC;"
+    )
+
+
+def test_swap_sql_keyed_assigns_game_id_and_dedupes_reviews_on_it():
+    sales = bulk_load._swap_sql("game_sales", keyed=True)
+    assert "ON t.normalized_title = normalize_title(s.game)" in sales
+    assert "DISTINCT ON (s.game, s.platform)" in sales
+    assert sales.startswith("INSERT INTO game_sales (game, platform, publisher,")
+    assert ", game_id)\n" in sales
+
+    reviews = bulk_load._swap_sql("reviews", keyed=True)
+    assert (
+        "DISTINCT ON (t.game_id) s.game, s.critic_score, s.user_score, t.game_id"
+        in reviews
+    )
+    assert reviews.endswith("ORDER BY t.game_id, s.staging_seq DESC;")
@@ -0,0 +1,129 @@
+from decimal import Decimal as D
+
+import pytest
+
+from games import columnar
+
+# "zeta!" normalizes to the review title "Zeta"; "Omega" has no review;
+# "Alpha" on PC has a NULL year.
+GAME_SALES = [
+    ("zeta!", "NES", "Pub", "Dev", "30", "1990"),
+    ("Zeta", "XB", "Pub", "Dev", "20", "2002"),
+    ("Alpha", "PS2", "Pub", "Dev", "10.5", "1998"),
+    ("Alpha", "PC", "Pub", "Dev", "7.0", None),
+    ("Beta", "PS2", "Pub", "Dev", "5.25", "1998"),
+    ("Alpha", "XB", "Pub", "Dev", "4", "2002"),
+    ("Beta", "XB", "Pub", "Dev", "3.75", "2002"),
+    ("Gamma", "PS2", "Pub", "Dev", "3", "1998"),
+    ("Delta", "PS2", "Pub", "Dev", "2.5", "1998"),
+    ("Omega", "PC", "Pub", "Dev", "2.25", "1998"),
+    ("Gamma", "XB", "Pub", "Dev", "2", "2002"),
+    ("Epsilon", "PS2", "Pub", "Dev", "1.5", "1998"),
+    ("Epsilon", "XB", "Pub", "Dev", "1", "2002"),
+    ("Delta", "XB", "Pub", "Dev", "0.5", "2002"),
+]
+REVIEWS = [
+    ("Alpha", "9.0", "8.0"),
+    ("Beta", "8.0", "9.5"),
+    ("Gamma", "7.0", None),
+    ("Delta", None, None),
+    ("Epsilon", "6.5", "7.5"),
+    ("Zeta", "10.0", "9.0"),
+]
+
+
+@pytest.fixture
+def engine():
+    return columnar.Engine(columnar.Tables(GAME_SALES, REVIEWS))
+
+
+def rows(result):
+    return list(zip(*(result.columns[key].tolist() for key in result.keys)))
+
+
+def test_normalize_title():
+    assert columnar.normalize_title("  Zeta!  ") == "zeta"
+    assert columnar.normalize_title("Halo: Combat_Evolved") == "halo combat evolved"
+
+
+def test_top_selling_games(engine):
+    result = engine.run("In[19]")
+    assert result.keys == columnar.GAME_SALES_COLUMNS
+    assert result.DataFrame().shape == (10, 6)
+    assert [row[0] for row in rows(result)] == [
+        "zeta!",
+        "Zeta",
+        "Alpha",
+        "Alpha",
+        "Beta",
+        "Alpha",
+        "Beta",
+        "Gamma",
+        "Delta",
+        "Omega",
+    ]
+    assert rows(result)[3][4:] == (D("7.00"), None)
+    assert rows(result)[0][5] == 1990
+
+
+def test_count_missing_reviews(engine):
+    assert rows(engine.run("In[20]")) == [(3,)]
+
+
+def test_top_critic_years_keeps_null_year(engine):
+    result = engine.run("In[22]")
+    assert result.keys == ["year", "avg_critic_score"]
+    assert rows(result) == [
+        (1990, D("10.00")),
+        (None, D("9.00")),
+        (2002, D("8.10")),
+        (1998, D("7.63")),
+    ]
+
+
+def test_top_critic_years_more_than_four_games(engine):
+    result = engine.run("In[24]")
+    assert result.keys == ["year", "avg_critic_score", "num_games"]
+    assert rows(result) == [(2002, D("6.75"), 6), (1998, D("6.10"), 5)]
+
+
+def test_critic_years_dropped(engine):
+    assert rows(engine.run("In[26]")) == [
+        (1990, D("10.00")),
+        (None, D("9.00")),
+        (2002, D("8.10")),
+        (1998, D("7.63")),
+    ]
+
+
+def test_top_user_years_more_than_four_games(engine):
+    result = engine.run("In[28]")
+    assert result.keys == ["year", "num_games", "avg_user_score"]
+    assert rows(result) == [(2002, 6, D("8.50")), (1998, 5, D("8.33"))]
+
+
+def test_years_both_loved(engine):
+    assert rows(engine.run("In[30]")) == [(2002,), (1998,)]
+
+
+def test_years_both_loved_never_matches_null_year():
+    # Five more reviewed NULL-year rows put the NULL year in both top tens.
+    extra = [(game, "GC", "Pub", "Dev", "1", None) for game in ("Beta", "Gamma")]
+    extra += [
+        (game, "PC", "Pub", "Dev", "1", None) for game in ("Beta", "Zeta", "Epsilon")
+    ]
+    engine = columnar.Engine(columnar.Tables(GAME_SALES + extra, REVIEWS))
+    assert None in engine.run("In[24]").columns["year"].tolist()
+    assert None in engine.run("In[28]").columns["year"].tolist()
+    assert rows(engine.run("In[30]")) == [(2002,), (1998,)]
+
+
+def test_best_years_sales(engine):
+    result = engine.run("In[32]")
+    assert result.keys == ["year", "total_games_sold"]
+    assert rows(result) == [(2002, D("31.25")), (1998, D("22.75"))]
+
+
+def test_unknown_cell(engine):
+    with pytest.raises(KeyError):
+        engine.run("In[99]")
@@ -0,0 +1,67 @@
+import pytest
+
+from games import derived
+
+
+class Cursor:
+    """Answers table_fingerprint's queries from canned rows, in order."""
+
+    def __init__(self, *rows):
+        self.rows = list(rows)
+        self.sql = []
+
+    def execute(self, sql, params=None):
+        self.sql.append(sql)
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+
+def registry(**sources):
+    tables = derived.DerivedTables()
+    for name, reads in sources.items():
+        tables.register(name, "SELECT 1;", reads)
+    return tables
+
+
+def test_order_puts_inputs_first_and_skips_base_tables():
+    tables = registry(c=["b", "game_sales"], b=["a"], a=["reviews"])
+    assert tables.order() == ["a", "b", "c"]
+    assert tables.order(["b"]) == ["a", "b"]
+    assert tables.tables["a"].query == "SELECT 1"
+
+
+def test_order_rejects_cycles_and_unknown_names():
+    with pytest.raises(ValueError, match="cycle"):
+        registry(a=["b"], b=["a"]).order()
+    with pytest.raises(KeyError):
+        registry(a=[]).order(["missing"])
+
+
+def test_case_study_tables_read_the_base_tables():
+    tables = derived.case_study_tables()
+    assert tables.order() == [
+        "top_critic_years",
+        "top_critic_years_more_than_four_games",
+        "top_user_years_more_than_four_games",
+    ]
+    assert all(t.sources == ["game_sales", "reviews"] for t in tables.tables.values())
+
+
+def test_table_fingerprint_prefers_the_version_counter():
+    cur = Cursor((16384, "table_versions"), (7,))
+    assert derived.table_fingerprint(cur, "game_sales") == "16384v7"
+    assert len(cur.sql) == 2
+
+
+def test_table_fingerprint_hashes_contents_without_a_counter():
+    cur = Cursor((16390, None), (10, 123456789))
+    assert derived.table_fingerprint(cur, "top_critic_years") == "16390h10:123456789"
+    assert "md5(t::text)" in cur.sql[-1]
+
+    cur = Cursor((16390, "table_versions"), None, (10, 5))
+    assert derived.table_fingerprint(cur, "top_critic_years") == "16390h10:5"
+
+
+def test_table_fingerprint_missing_table():
+    assert derived.table_fingerprint(Cursor((None, None)), "nope") is None
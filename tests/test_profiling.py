@@ -0,0 +1,50 @@
+from games import profiling
+
+
+def reviews_scan(**node):
+    return dict({"Node Type": "Seq Scan", "Relation Name": "reviews"}, **node)
+
+
+def test_check_plan_ignores_full_scan_feeding_hash_join():
+    plan = {
+        "Node Type": "Hash Join",
+        "Plans": [
+            {"Node Type": "Seq Scan", "Relation Name": "game_sales"},
+            {"Node Type": "Hash", "Plans": [reviews_scan(**{"Actual Rows": 6})]},
+        ],
+    }
+    assert profiling.check_plan(plan) == []
+
+
+def test_check_plan_flags_filtered_and_nested_loop_scans():
+    filtered = reviews_scan(
+        **{
+            "Filter": "(critic_score > 9)",
+            "Actual Rows": 2,
+            "Rows Removed by Filter": 4,
+        }
+    )
+    assert profiling.check_plan(filtered) == [
+        "filtered seq scan on reviews (2 rows, 4 removed)"
+    ]
+
+    nested = {
+        "Node Type": "Nested Loop",
+        "Plans": [
+            {"Node Type": "Seq Scan", "Relation Name": "game_sales"},
+            reviews_scan(**{"Parent Relationship": "Inner", "Actual Loops": 10}),
+        ],
+    }
+    assert profiling.check_plan(nested) == [
+        "seq scan on reviews repeated 10 times inside a nested loop"
+    ]
+
+
+def test_auto_explain_plan_reads_last_notice():
+    notices = [
+        "NOTICE:  some other message\n",
+        'NOTICE:  duration: 1.250 ms  plan:\n{"Query Text": "SELECT 1", '
+        '"Plan": {"Node Type": "Result"}}\n',
+    ]
+    assert profiling._auto_explain_plan(notices) == (1.25, {"Node Type": "Result"})
+    assert profiling._auto_explain_plan(notices[:1]) is None
@@ -0,0 +1,70 @@
+from decimal import Decimal as D
+
+from games import results
+from games.result_cache import ResultCache, normalize_sql, table_stamps
+
+
+def test_normalize_sql_collapses_case_whitespace_and_comments():
+    assert (
+        normalize_sql("SELECT  year\n FROM game_sales -- note\nLIMIT 10;")
+        == normalize_sql("select year /* other */ from game_sales limit 10")
+        == "select year from game_sales limit 10"
+    )
+
+
+def test_normalize_sql_keeps_literals_verbatim():
+    assert normalize_sql("SELECT 1 WHERE game = 'Halo  3'") != normalize_sql(
+        "SELECT 1 WHERE game = 'Halo 3'"
+    )
+    assert normalize_sql("SELECT 'A -- b'") == "select 'A -- b'"
+    assert normalize_sql('SELECT "Year"') != normalize_sql('SELECT "year"')
+
+
+def test_normalize_sql_keeps_dollar_and_escape_literals_verbatim():
+    assert normalize_sql("SELECT $$a   b$$") == "select $$a   b$$"
+    assert normalize_sql("SELECT $$a   b$$") != normalize_sql("SELECT $$a b$$")
+    assert normalize_sql("SELECT $t$ x $$ -- y $t$") == "select $t$ x $$ -- y $t$"
+    assert normalize_sql(r"SELECT E'it\'s  A'") == r"select E'it\'s  A'"
+    assert normalize_sql(r"SELECT E'a\'  B'") != normalize_sql(r"SELECT E'a\' B'")
+
+
+def test_table_stamps_refuses_unresolved_names():
+    class Cursor:
+        def execute(self, sql, params=None):
+            self.params = params
+
+        def fetchone(self):
+            return None
+
+    cur = Cursor()
+    assert table_stamps(cur, ["public"]) is None
+    assert cur.params == ("public",)
+
+
+def test_key_depends_on_database_and_stamps(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    stamps = {"game_sales": "table_versions@1:3"}
+    key = cache.key("SELECT 1", stamps, "1/games/16384")
+    assert key == cache.key("select 1;", stamps, "1/games/16384")
+    assert key != cache.key("SELECT 1", stamps, "1/games/16385")
+    assert key != cache.key(
+        "SELECT 1", {"game_sales": "table_versions@1:4"}, "1/games/16384"
+    )
+
+
+def test_put_get_and_lru_eviction(tmp_path):
+    result = results.from_rows(["year", "score"], [(1990, D("9.80"))] * 50)
+    cache = ResultCache(str(tmp_path))
+    cache.put("a", result)
+    got = cache.get("a")
+    assert got.keys == ["year", "score"]
+    assert got.columns["score"].tolist() == [D("9.80")] * 50
+    assert cache.get("missing") is None
+    assert cache.hit_rate() == 0.5
+
+    small = ResultCache(str(tmp_path / "small"), max_bytes=cache.size_bytes * 2)
+    for key in ("a", "b", "c"):
+        small.put(key, result)
+    assert small.stats["evictions"] == 1
+    assert small.get("a") is None
+    assert small.get("c") is not None
@@ -0,0 +1,75 @@
+from decimal import Decimal as D
+
+import numpy as np
+
+from games import results
+
+
+def test_to_array_numeric_exact_and_float():
+    exact = results._to_array(["9.32", None], results.NUMERIC_TYPE, exact=True)
+    assert exact.dtype == object
+    assert exact.tolist() == [D("9.32"), None]
+
+    floats = results._to_array(["9.32", None], results.NUMERIC_TYPE)
+    assert floats.dtype == np.float64
+    assert floats[0] == 9.32 and np.isnan(floats[1])
+
+
+def test_to_array_integers_with_nulls():
+    assert results._to_array([1, 2], 23).dtype == np.int64
+    assert results._to_array([1, None], 23).dtype == np.float64
+
+
+def test_from_rows_keeps_driver_values():
+    result = results.from_rows(["year", "score"], [(1990, D("9.80")), (1991, None)])
+    assert result.columns["year"].dtype == np.int64
+    assert result.columns["score"].tolist() == [D("9.80"), None]
+    assert len(result) == 2
+    assert result.DataFrame() is result.DataFrame()
+
+
+def test_stream_rows_runs_other_statements_directly():
+    class Cursor:
+        description = None
+
+        def execute(self, sql):
+            self.sql = sql
+
+    cur = Cursor()
+    assert results.stream_rows(cur, "CREATE TABLE t (x int)") is None
+    assert cur.sql == "CREATE TABLE t (x int)"
+
+
+class Column:
+    def __init__(self, name, type_code):
+        self.name, self.type_code = name, type_code
+
+
+class Cursor:
+    """A plain cursor over canned rows."""
+
+    def __init__(self, rows, description):
+        self.rows = list(rows)
+        self.description = None
+        self._description = description
+
+    def execute(self, sql, params=None):
+        self.description = self._description
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+
+def test_fetch_rows_records_phase_timings():
+    cur = Cursor([(1990, 3), (1991, 4)], [Column("year", 23), Column("n", 20)])
+    timings = {}
+    result = results.fetch_rows(cur, "SELECT year, n FROM t", timings)
+    assert result.columns["year"].tolist() == [1990, 1991]
+    assert set(timings) == {"execute", "fetch", "convert"}
+
+    timings = {}
+    assert (
+        results.stream_rows(Cursor([], None), "CREATE TABLE t (x int)", timings) is None
+    )
+    assert set(timings) == {"execute"}
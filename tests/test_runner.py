@@ -0,0 +1,116 @@
+from decimal import Decimal as D
+
+import pytest
+
+from games import notebook, results, runner
+from games.columnar import GAME_SALES_COLUMNS
+
+
+@pytest.fixture(scope="module")
+def cells():
+    return notebook.read_cells()
+
+
+def by_label(cells, label):
+    return next(cell for cell in cells if cell.label == label)
+
+
+def test_read_cells(cells):
+    assert [(cell.label, cell.magic) for cell in cells][:3] == [
+        ("In[19]", "sql"),
+        ("In[20]", "sql"),
+        ("In[21]", "nose"),
+    ]
+    assert sum(cell.magic == "sql" for cell in cells) == 8
+    assert sum(cell.magic == "nose" for cell in cells) == 8
+
+
+def test_pair_tests(cells):
+    pairs = [(sql.label, nose.label) for sql, nose in notebook.pair_tests(cells)]
+    assert pairs == [
+        ("In[20]", "In[21]"),
+        ("In[22]", "In[23]"),
+        ("In[24]", "In[25]"),
+        ("In[26]", "In[27]"),
+        ("In[28]", "In[29]"),
+        ("In[30]", "In[31]"),
+        ("In[32]", "In[33]"),
+        ("In[19]", "In[34]"),
+    ]
+
+
+def test_split_connection(cells):
+    connection, sql = notebook.split_connection(by_label(cells, "In[19]").body)
+    assert connection == "postgresql:///games"
+    assert "SELECT game, platform, publisher, developer, games_sold, year" in sql
+    assert notebook.split_connection("SELECT 1") == (None, "SELECT 1")
+
+
+def test_referenced_tables(cells):
+    _, sql = notebook.split_connection(by_label(cells, "In[22]").body)
+    assert notebook.referenced_tables(sql) == ["game_sales", "reviews"]
+    assert notebook.referenced_tables(
+        "-- FROM nowhere\nSELECT year FROM top_critic_years EXCEPT "
+        "SELECT year FROM top_critic_years_more_than_four_games"
+    ) == ["top_critic_years", "top_critic_years_more_than_four_games"]
+
+
+def test_referenced_tables_qualified_quoted_and_comma_lists():
+    assert notebook.referenced_tables("SELECT * FROM public.game_sales") == [
+        "public.game_sales"
+    ]
+    assert notebook.referenced_tables(
+        "SELECT 1 FROM game_sales g, reviews r WHERE g.game_id = r.game_id"
+    ) == ["game_sales", "reviews"]
+    assert notebook.referenced_tables(
+        'SELECT * FROM "Game_Sales" JOIN "reviews" USING (game_id)'
+    ) == ['"Game_Sales"', "reviews"]
+
+
+def test_referenced_tables_skips_ctes_literals_and_expressions():
+    assert notebook.referenced_tables(
+        "WITH y AS (SELECT year FROM game_sales)\n"
+        "SELECT EXTRACT(year FROM now()), 'FROM x', $$ FROM z $$\n"
+        "FROM y, (SELECT 1 FROM reviews) AS r\n"
+        "WHERE y.year IS DISTINCT FROM 1 AND y.year IN (SELECT year FROM top_critic_years)"
+    ) == ["game_sales", "reviews", "top_critic_years"]
+
+
+def outcomes(cells, label, result):
+    return {
+        name: outcome
+        for name, outcome, _ in runner.run_tests(by_label(cells, label), result)
+    }
+
+
+def top_critic_years(first_score):
+    rows = [(1990, first_score)] + [(2000 + i, D("8.00")) for i in range(9)]
+    return results.from_rows(["year", "avg_critic_score"], rows)
+
+
+def test_run_tests_passes_with_exact_decimals(cells):
+    assert outcomes(cells, "In[23]", top_critic_years(D("9.80"))) == {
+        "test_output_type": "skipped",
+        "test_results": "passed",
+    }
+
+
+def test_run_tests_fails_with_float_numeric(cells):
+    assert outcomes(cells, "In[23]", top_critic_years(9.8))["test_results"] == "failed"
+
+
+def test_run_tests_top_selling_games_shape(cells):
+    rows = [("Wii Sports", "Wii", "Nintendo", "Nintendo EAD", D("82.90"), 2006)]
+    rows += [("Game {}".format(i), "PC", "P", "D", D("1.00"), 2000) for i in range(9)]
+    result = results.from_rows(GAME_SALES_COLUMNS, rows)
+    assert outcomes(cells, "In[34]", result)["test_results"] == "passed"
+
+    with_game_id = results.from_rows(
+        GAME_SALES_COLUMNS + ["game_id"], [row + (i,) for i, row in enumerate(rows)]
+    )
+    assert outcomes(cells, "In[34]", with_game_id)["test_results"] == "failed"
+
+
+def test_run_tests_reports_cell_errors(cells):
+    [(name, outcome, _)] = runner.run_tests(by_label(cells, "In[21]"), None)
+    assert (name, outcome) == ("<cell>", "error")
@@ -0,0 +1,145 @@
+import sqlite3
+
+import pytest
+
+from games import year_summary
+
+# The sales trigger's statements are plain enough SQL for SQLite, which lets
+# them run offline against transition tables filled by hand.
+SALES = "game text, games_sold numeric, year int, game_id int"
+
+
+@pytest.fixture
+def db():
+    db = sqlite3.connect(":memory:")
+    columns = ", ".join(
+        "{} NOT NULL DEFAULT 0".format(name) for name in year_summary.COLUMN_NAMES
+    )
+    db.executescript(
+        "CREATE TABLE year_summary (year int PRIMARY KEY, {});\n"
+        "CREATE TABLE game_sales ({});\n"
+        "CREATE TABLE reviews (game_id int, critic_score numeric, user_score numeric);\n"
+        "INSERT INTO reviews VALUES (1, 8.0, 7.0), (2, NULL, NULL), (3, 6.5, NULL);".format(
+            columns, SALES
+        )
+    )
+    return db
+
+
+def summary(db):
+    return db.execute("SELECT * FROM year_summary ORDER BY year").fetchall()
+
+
+def rebuilt(db):
+    db.execute("DELETE FROM year_summary")
+    db.execute(
+        year_summary._apply([year_summary._contribution("game_sales", "reviews", 1)])
+    )
+    db.execute(year_summary._PRUNE)
+    return summary(db)
+
+
+def fire(db, tg_op, new=(), old=()):
+    """Run the sales trigger body for one statement, as the AFTER trigger would."""
+    db.executescript(
+        "DROP TABLE IF EXISTS new_rows; DROP TABLE IF EXISTS old_rows;\n"
+        "CREATE TABLE new_rows ({0}); CREATE TABLE old_rows ({0});".format(SALES)
+    )
+    db.executemany("INSERT INTO new_rows VALUES (?, ?, ?, ?)", new)
+    db.executemany("INSERT INTO old_rows VALUES (?, ?, ?, ?)", old)
+    for row in old:
+        db.execute(
+            "DELETE FROM game_sales WHERE rowid = (SELECT rowid FROM game_sales"
+            " WHERE game = ? AND year IS ? LIMIT 1)",
+            (row[0], row[2]),
+        )
+    db.executemany("INSERT INTO game_sales VALUES (?, ?, ?, ?)", new)
+    db.execute(year_summary._sales_delta(tg_op))
+    db.execute(year_summary._PRUNE)
+
+
+def test_sales_deltas_match_a_rebuild(db):
+    fire(
+        db,
+        "INSERT",
+        new=[
+            ("a", 1.5, 2000, 1),
+            ("a", 2.25, 2001, 1),
+            ("b", 4, 2000, 2),
+            ("c", None, None, 3),
+            ("d", 0.5, 2000, 4),
+        ],
+    )
+    after_insert = summary(db)
+    assert after_insert == rebuilt(db)
+    # NULL years are kept under the sentinel, not dropped.
+    assert after_insert[0][0] == year_summary.NULL_YEAR
+
+    fire(db, "UPDATE", new=[("c", 3, 2001, 3)], old=[("c", None, None, 3)])
+    assert summary(db) == rebuilt(db)
+    assert year_summary.NULL_YEAR not in [row[0] for row in summary(db)]
+
+    fire(
+        db, "DELETE", old=[("a", 1.5, 2000, 1), ("b", 4, 2000, 2), ("d", 0.5, 2000, 4)]
+    )
+    assert summary(db) == rebuilt(db)
+    assert 2000 not in [row[0] for row in summary(db)]
+
+
+def test_sales_delta_counts_unreviewed_and_unscored_rows(db):
+    fire(db, "INSERT", new=[("b", 1, 2000, 2), ("z", 1, 2000, 9), ("a", 1, 2000, 1)])
+    row = dict(zip(["year"] + year_summary.COLUMN_NAMES, summary(db)[0]))
+    assert (row["num_games"], row["num_unreviewed"], row["num_unscored"]) == (2, 1, 1)
+    assert (row["critic_count"], row["user_count"]) == (1, 1)
+    assert (row["games_sold_sum"], row["games_sold_count"]) == (2, 2)
+
+
+@pytest.mark.parametrize(
+    "tg_op, affected, before",
+    [
+        (
+            "INSERT",
+            "SELECT game_id FROM new_rows",
+            " EXCEPT ALL SELECT game_id, critic_score, user_score FROM new_rows)",
+        ),
+        (
+            "DELETE",
+            "SELECT game_id FROM old_rows",
+            " UNION ALL SELECT game_id, critic_score, user_score FROM old_rows)",
+        ),
+        (
+            "UPDATE",
+            "SELECT game_id FROM new_rows UNION SELECT game_id FROM old_rows",
+            " EXCEPT ALL SELECT game_id, critic_score, user_score FROM new_rows)"
+            " UNION ALL SELECT game_id, critic_score, user_score FROM old_rows)",
+        ),
+    ],
+)
+def test_reviews_delta_rebuilds_the_old_state(tg_op, affected, before):
+    sql = year_summary._reviews_delta(tg_op)
+    assert sql.startswith("WITH affected AS ({}),\n".format(affected))
+    assert before + ",\n     reviews_after AS (SELECT" in sql
+    # Every sales row of an affected game moves from its old to its new state.
+    assert sql.count("WHERE g.game_id IN (SELECT game_id FROM affected)") == 2
+    assert "LEFT JOIN reviews_after AS r" in sql
+    assert "-1 * COUNT(r.game_id) AS num_games" in sql
+    assert "LEFT JOIN reviews_before AS r" in sql
+
+
+def test_apply_adds_onto_existing_years():
+    sql = year_summary._apply(["SELECT 1", "SELECT 2"])
+    assert "FROM (\nSELECT 1\nUNION ALL\nSELECT 2\n) AS delta" in sql
+    assert "ON CONFLICT (year) DO UPDATE SET" in sql
+    assert "num_games = year_summary.num_games + EXCLUDED.num_games" in sql
+
+
+def test_trigger_functions_lock_first_and_prune_last():
+    body = year_summary._trigger_function("f", year_summary._sales_delta)
+    assert body.index(year_summary._LOCK) < body.index("IF TG_OP = 'INSERT'")
+    assert body.index("ELSIF TG_OP = 'UPDATE'") < body.index(year_summary._PRUNE)
+    assert year_summary.REBUILD.startswith(year_summary._LOCK)
+
+
+def test_queries_map_the_sentinel_back_to_null():
+    for cell in ("In[22]", "In[24]", "In[28]"):
+        assert "NULLIF(year, -1) AS year" in year_summary.QUERIES[cell]